@@ -0,0 +1,295 @@
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from queue import Empty
+
+import pre_commit_hooks_cpp
+
+WORDS = ['int', 'char', 'void', 'return', 'const', 'static', 'struct', 'value', 'size_t',
+         'std::vector<int>', 'x', 'y', 'i', 'j', 'result', 'buffer', 'count', '+', '-', '*',
+         '=', '==', '<', '>', '(', ')', '{', '}', ';', ',', '0', '1', '42']
+
+def random_line(rnd, tabs=False):
+    indent = '\t'*rnd.randrange(0, 4) if tabs else ' '*4*rnd.randrange(0, 4)
+    words = ' '.join(rnd.choice(WORDS) for _ in range(rnd.randrange(0, 12)))
+    tail = ' '*rnd.randrange(0, 3) if rnd.random() < 0.2 else ''
+    return indent + words + tail + '\n'
+
+def random_source(rnd, lines, tabs=False, includes=()):
+    result = []
+    for name in includes: result.append('#include "{}"\n'.format(name))
+    result.append('\n')
+    for _ in range(lines): result.append(random_line(rnd, tabs))
+    return ''.join(result)
+
+def write(directory, name, content, encoding='utf-8'):
+    filename = os.path.join(directory, name)
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename, 'w', encoding=encoding, newline='') as f:
+        f.write(content)
+    return name
+
+def small_headers(directory, rnd, scale):
+    return [write(directory, 'src/small/h{}.hh'.format(i), random_source(rnd, 30))
+            for i in range(int(2000*scale))]
+
+def huge_files(directory, rnd, scale):
+    return [write(directory, 'src/huge/g{}.hh'.format(i), random_source(rnd, int(200000*scale)))
+            for i in range(2)]
+
+def tab_heavy(directory, rnd, scale):
+    return [write(directory, 'src/tabs/t{}.cc'.format(i), random_source(rnd, 500, tabs=True))
+            for i in range(int(200*scale))]
+
+def non_utf8(directory, rnd, scale):
+    result = []
+    for i in range(int(200*scale)):
+        content = random_source(rnd, 100) + '// café, naïve, déjà vu, façade, über, señor\n'*20
+        result.append(write(directory, 'src/latin/l{}.cc'.format(i), content, 'latin-1'))
+    return result
+
+def include_heavy(directory, rnd, scale):
+    headers = [write(directory, 'src/lib/m{}/h{}.hh'.format(i % 20, i), random_source(rnd, 10))
+               for i in range(int(500*scale))]
+    result = []
+    for i in range(int(200*scale)):
+        includes = ['../' + h[len('src/'):] for h in rnd.sample(headers, min(50, len(headers)))]
+        result.append(write(directory, 'src/tu/u{}.cc'.format(i),
+                            random_source(rnd, 100, includes=includes)))
+    return result
+
+def opencl(directory, rnd, scale):
+    kernel = '__kernel void f(__global float* x, __local float* y, __constant int* z) {\n'
+    return [write(directory, 'src/cl/k{}.cl'.format(i),
+                  kernel + random_source(rnd, int(2000*scale)) + '}\n')
+            for i in range(20)]
+
+def git_history(directory, rnd, scale):
+    """Repository with long history written with git fast-import"""
+    nfiles = int(200*scale)
+    ncommits = int(5000*scale)
+    names = ['src/f{}.cc'.format(i) for i in range(nfiles)]
+    stream = io.BytesIO()
+    for i in range(ncommits):
+        author = 'Author {}'.format(rnd.randrange(10))
+        when = 946684800 + i*3600*6
+        message = b'commit'
+        stream.write('commit refs/heads/master\nauthor {0} <a@b> {1} +0000\n'
+                     'committer {0} <a@b> {1} +0000\n'.format(author, when).encode())
+        stream.write(b'data %d\n%s\n' % (len(message), message))
+        if i == 0:
+            for name in names:
+                data = random_source(rnd, 20).encode()
+                stream.write(b'M 100644 inline %s\ndata %d\n%s\n' % (name.encode(), len(data), data))
+            continue
+        if rnd.random() < 0.05:
+            j = rnd.randrange(nfiles)
+            new_name = names[j].replace('.cc', 'r.cc')
+            stream.write(b'R %s %s\n' % (names[j].encode(), new_name.encode()))
+            names[j] = new_name
+            continue
+        name = rnd.choice(names)
+        data = random_source(rnd, 20).encode()
+        stream.write(b'M 100644 inline %s\ndata %d\n%s\n' % (name.encode(), len(data), data))
+    subprocess.run(['git', 'init', '-q', directory], check=True)
+    subprocess.run(['git', '-C', directory, 'fast-import', '--quiet'], input=stream.getvalue(),
+                   check=True)
+    subprocess.run(['git', '-C', directory, 'checkout', '-q', '-f', 'master'], check=True)
+    subprocess.run(['git', '-C', directory, 'config', 'user.name', 'Bench'], check=True)
+    return names
+
+# name, hook module, corpus, hook arguments
+CASES = [
+    ('normalise-small', 'normalise', small_headers, []),
+    ('normalise-huge', 'normalise', huge_files, []),
+    ('normalise-tabs', 'normalise', tab_heavy, []),
+    ('normalise-non-utf8', 'normalise', non_utf8, []),
+    ('header-guard-small', 'header_guard', small_headers, []),
+    ('normalise-cpp-includes', 'normalise_cpp', include_heavy, ['--src=src']),
+    ('normalise-cpp-indent', 'normalise_cpp', tab_heavy, ['--src=src', '--indent']),
+    ('normalise-opencl', 'normalise_opencl', opencl, []),
+    ('legal-history', 'legal', git_history, []),
+]
+
+# modules of the console entry points
+ENTRY_POINTS = ['normalise', 'header_guard', 'normalise_cpp', 'normalise_opencl', 'legal', 'driver']
+
+def import_time(module):
+    """Return cumulative import time of the module in seconds measured with -X importtime"""
+    name = 'pre_commit_hooks_cpp.' + module
+    env = dict(os.environ)
+    path = os.path.dirname(os.path.dirname(os.path.abspath(pre_commit_hooks_cpp.__file__)))
+    env['PYTHONPATH'] = os.pathsep.join(p for p in [path, env.get('PYTHONPATH')] if p)
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + name],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, env=env, check=True)
+    for line in result.stderr.decode().splitlines():
+        fields = line.split('|')
+        if len(fields) == 3 and fields[2].strip() == name: return int(fields[1])/1e6
+    return None
+
+def startup(args):
+    """Return median import time of every entry point"""
+    return {module: statistics.median(import_time(module) for _ in range(args.repeat))
+            for module in ENTRY_POINTS}
+
+def peak_rss():
+    """Return peak resident set size of this process in KiB or None if unknown"""
+    # ru_maxrss survives exec, so a spawned child would report the peak of its parent
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'): return int(line.split()[1])
+    except OSError:
+        pass
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    except ImportError:
+        return None
+
+def _measure(module, directory, filenames, arguments, queue):
+    try:
+        os.chdir(directory)
+        from pre_commit_hooks_cpp import timings
+        main = __import__('pre_commit_hooks_cpp.' + module, fromlist=['main']).main
+        trace = os.path.join(directory, '.trace.json')
+        argv = filenames + arguments + ['--jobs=1', '--no-cache', '--trace=' + trace]
+        start = time.perf_counter()
+        with redirect_stdout(io.StringIO()):
+            main(argv)
+        seconds = time.perf_counter() - start
+        # the child exits without running atexit handlers
+        timings.report()
+        with open(trace) as f:
+            stages = json.load(f)['total']['stages']
+        queue.put((seconds, peak_rss(), stages))
+    except BaseException:
+        import traceback
+        queue.put(traceback.format_exc())
+
+def wait_result(process, queue, timeout):
+    """Return the result of the measuring process or raise RuntimeError if it fails"""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            result = queue.get(timeout=0.1)
+            break
+        except Empty:
+            pass
+        if not process.is_alive():
+            try:
+                result = queue.get(timeout=1)
+                break
+            except Empty:
+                raise RuntimeError('hook exited with code {}'.format(process.exitcode))
+        if time.monotonic() > deadline:
+            process.terminate()
+            raise RuntimeError('timed out after {} seconds'.format(timeout))
+    if isinstance(result, str): raise RuntimeError(result)
+    return result
+
+def run_case(case, args):
+    name, module, corpus, arguments = case
+    runs = []
+    for i in range(args.repeat):
+        directory = tempfile.mkdtemp(prefix='pre-commit-cpp-bench-')
+        try:
+            start = time.perf_counter()
+            filenames = corpus(directory, random.Random(args.seed), args.scale)
+            setup = time.perf_counter() - start
+            size = sum(os.path.getsize(os.path.join(directory, f)) for f in filenames)
+            # a forked child would inherit the memory of this process
+            context = multiprocessing.get_context('spawn')
+            queue = context.Queue()
+            process = context.Process(target=_measure,
+                                      args=(module, directory, filenames, arguments, queue))
+            process.start()
+            try:
+                seconds, peak, stages = wait_result(process, queue, args.timeout)
+            finally:
+                process.join()
+            runs.append((seconds, peak, setup, stages))
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+    seconds = statistics.median(r[0] for r in runs)
+    return {
+        'case': name,
+        'hook': module,
+        'files': len(filenames),
+        'bytes': size,
+        'seconds': seconds,
+        'mb_per_second': size/seconds/1e6 if seconds else None,
+        'files_per_second': len(filenames)/seconds if seconds else None,
+        'peak_rss_kb': max((r[1] for r in runs if r[1] is not None), default=None),
+        'stages': {'setup': statistics.median(r[2] for r in runs), 'run': seconds},
+        'hook_stages': {name: statistics.median(r[3].get(name, 0.0) for r in runs)
+                        for name in sorted(set().union(*(r[3] for r in runs)))},
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the hooks on synthetic corpora')
+    parser.add_argument('cases', nargs='*', help='Cases to run (default: all)')
+    parser.add_argument('--repeat', help='No. of runs per case', default=3, type=int)
+    parser.add_argument('--scale', help='Corpus size multiplier', default=1.0, type=float)
+    parser.add_argument('--seed', help='Random seed', default=0, type=int)
+    parser.add_argument('--output', help='Write JSON results to this file', default=None)
+    parser.add_argument('--timeout', help='Max. seconds per run of a case', default=600,
+                        type=float)
+    parser.add_argument('--startup-budget', type=float, default=None,
+                        help='Fail if importing any entry point takes longer (milliseconds)')
+    args = parser.parse_args(argv)
+    unknown = set(args.cases) - {c[0] for c in CASES} - {'startup'}
+    if unknown: parser.error('unknown cases: ' + ', '.join(sorted(unknown)))
+    ret = 0
+    startup_times = {}
+    if not args.cases or 'startup' in args.cases:
+        startup_times = startup(args)
+        for module, seconds in startup_times.items():
+            print('{:<24} {:>10.1f} ms import time'.format(module, seconds*1e3), file=sys.stderr)
+            if args.startup_budget is not None and seconds*1e3 > args.startup_budget:
+                print('{}: import time exceeds the budget of {} ms'.format(
+                    module, args.startup_budget), file=sys.stderr)
+                ret = 1
+    results = []
+    for case in CASES:
+        if args.cases and case[0] not in args.cases: continue
+        try:
+            result = run_case(case, args)
+        except RuntimeError as e:
+            print('{}: {}'.format(case[0], e), file=sys.stderr)
+            ret = 1
+            continue
+        results.append(result)
+        print('{:<24} {:>8} files {:>10.2f} MB/s {:>10.1f} files/s {:>10} KiB'.format(
+            result['case'], result['files'], result['mb_per_second'] or 0,
+            result['files_per_second'] or 0, result['peak_rss_kb']), file=sys.stderr)
+    report = {
+        'version': pre_commit_hooks_cpp.__version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'scale': args.scale,
+        'seed': args.seed,
+        'startup': startup_times,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    return ret
+
+if __name__ == '__main__':
+    exit(main())
@@ -0,0 +1,79 @@
+import os
+import subprocess
+
+from pre_commit_hooks_cpp import timings
+from pre_commit_hooks_cpp.git import git_stream, split_nul
+
+# --from-index without argument reads the staged blobs
+INDEX = ':'
+
+class BlobReader:
+    """Long-lived git cat-file --batch process that reads blobs by object name"""
+
+    def __init__(self):
+        self.pid = os.getpid()
+        timings.count('subprocesses')
+        self.process = subprocess.Popen(['git', '--no-pager', 'cat-file', '--batch'],
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    def read(self, oid):
+        self.process.stdin.write(oid.encode('ascii') + b'\n')
+        self.process.stdin.flush()
+        header = self.process.stdout.readline().split()
+        if len(header) != 3: raise ValueError('{}: object not found'.format(oid))
+        size = int(header[2])
+        content = self.process.stdout.read(size)
+        self.process.stdout.read(1)
+        return content
+
+    def close(self):
+        self.process.stdin.close()
+        self.process.wait()
+
+_reader = None
+
+def read_blob(oid):
+    """Read the blob with one cat-file process per worker process"""
+    global _reader
+    if _reader is None or _reader.pid != os.getpid(): _reader = BlobReader()
+    return _reader.read(oid)
+
+def entries(treeish, filenames):
+    """Return (mode, object name, path) of the regular files staged in the index or stored
+    in the tree in the order of filenames (all files if filenames is None)"""
+    if treeish == INDEX:
+        command = ['--literal-pathspecs', 'ls-files', '-s', '-z', '--']
+    else:
+        command = ['ls-tree', '-r', '-z', treeish, '--']
+    process = git_stream(*command, *(filenames or []))
+    found = {}
+    for token in split_nul(process.stdout):
+        info, path = token.split('\t', 1)
+        info = info.split()
+        # skip unmerged entries and submodules
+        if treeish == INDEX and info[2] != '0': continue
+        if treeish != INDEX and info[1] != 'blob': continue
+        mode, oid = (info[0], info[1]) if treeish == INDEX else (info[0], info[2])
+        if mode == '160000' or mode == '120000': continue
+        found[path] = (mode, oid, path)
+    process.wait()
+    if process.returncode != 0: raise ValueError('{}: not a tree'.format(treeish))
+    if filenames is None: return list(found.values())
+    filenames = [os.path.normpath(f).replace(os.sep, '/') for f in filenames]
+    return [found[f] for f in filenames if f in found]
+
+def write_blob(content):
+    """Store the content in the object database and return its name"""
+    with timings.subprocess():
+        result = subprocess.run(['git', '--no-pager', 'hash-object', '-w', '--stdin'],
+                                input=content, stdout=subprocess.PIPE, check=True)
+    return result.stdout.decode('ascii').strip()
+
+def update_index(updates):
+    """Replace the staged blobs with the list of (mode, object name, path)"""
+    if not updates: return
+    info = b''.join('{} {}\t{}\0'.format(*u).encode('utf-8', 'surrogateescape')
+                    for u in updates)
+    with timings.subprocess():
+        subprocess.run(['git', '--no-pager', 'update-index', '-z', '--index-info'],
+                       input=info, check=True)
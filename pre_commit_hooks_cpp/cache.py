@@ -0,0 +1,177 @@
+import hashlib
+import json
+import os
+import time
+
+import pre_commit_hooks_cpp
+from pre_commit_hooks_cpp import executor, timings
+from pre_commit_hooks_cpp.files import read_json, write_json_atomic
+
+CACHE_MAX_ENTRIES = 200000
+# arguments that do not affect the result of a hook
+IGNORED_ARGUMENTS = {'filenames', 'jobs', 'no_cache', 'verbose', 'timings', 'timings_top',
+                     'trace', 'profile', 'check', 'diff',
+                     'all', 'include_cycles', 'include_fan_in'}
+
+def cache_dir():
+    directory = os.environ.get('PRE_COMMIT_CPP_CACHE')
+    if directory: return directory
+    directory = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(directory, 'pre-commit-cpp')
+
+def index_filename(kind, directory):
+    """Return the cache file of the index of the directory"""
+    name = hashlib.blake2b(directory.encode('utf-8', 'surrogateescape'),
+                           digest_size=20).hexdigest()
+    return os.path.join(cache_dir(), kind + '-' + name + '.json')
+
+def load_index(kind, directory, persist, update):
+    """Return the index that update(persisted data or None) builds together with the data to
+    persist (None if the index has not changed) and write the data to the cache"""
+    if not persist: return update(None)[0]
+    filename = index_filename(kind, directory)
+    index, data = update(read_json(filename))
+    if data is not None:
+        try:
+            write_json_atomic(filename, data)
+        except OSError:
+            pass
+    return index
+
+def update_entries(entries, filenames, jobs, scan, *args, directory=''):
+    """Return the entries of the files ([modification time, size, ...]) reusing the entries of
+    the unchanged files and calling scan(filename, *args) in parallel for the others"""
+    result = {}
+    changed = []
+    for filename in filenames:
+        try:
+            s = os.stat(os.path.join(directory, filename))
+        except OSError:
+            continue
+        entry = entries.get(filename)
+        if entry is None or entry[0] != s.st_mtime_ns or entry[1] != s.st_size:
+            changed.append(filename)
+        else:
+            result[filename] = entry
+    results = []
+    executor.run(scan, changed, jobs, *args, results=results)
+    result.update(results)
+    return result
+
+def file_digest(filename):
+    h = hashlib.blake2b(digest_size=20)
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024*1024), b''): h.update(chunk)
+    return h.hexdigest()
+
+class ResultCache:
+    """Files that a hook has already found normalised in the previous runs (LRU)"""
+
+    def __init__(self, hook, key, filename=None, max_entries=CACHE_MAX_ENTRIES):
+        if filename is None: filename = os.path.join(cache_dir(), 'results.sqlite')
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        self.key = hashlib.blake2b(json.dumps([hook, pre_commit_hooks_cpp.__version__, key],
+                                              sort_keys=True, default=str).encode('utf-8'),
+                                   digest_size=20).hexdigest()
+        self.max_entries = max_entries
+        self.digests = {}
+        import sqlite3
+        self.db = sqlite3.connect(filename, timeout=60)
+        with self.db:
+            self.db.execute('PRAGMA journal_mode=WAL')
+            self.db.execute('CREATE TABLE IF NOT EXISTS clean (digest TEXT PRIMARY KEY, used REAL)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS status (path TEXT, key TEXT, device INTEGER, '
+                            'inode INTEGER, mtime INTEGER, size INTEGER, digest TEXT, '
+                            'PRIMARY KEY (path, key))')
+
+    def _status(self, filename):
+        timings.count('stat')
+        s = os.stat(filename)
+        return os.path.abspath(filename), s.st_dev, s.st_ino, s.st_mtime_ns, s.st_size
+
+    def filter(self, filenames):
+        """Return the files that are not in the cache"""
+        import sqlite3
+        try:
+            return self._filter(filenames)
+        except sqlite3.Error:
+            return filenames
+
+    def filter_stream(self, filenames, size=1024):
+        """Yield the files that are not in the cache filtering them in batches"""
+        batch = []
+        for filename in filenames:
+            batch.append(filename)
+            if len(batch) < size: continue
+            yield from self.filter(batch)
+            batch = []
+        if batch: yield from self.filter(batch)
+
+    def _filter(self, filenames):
+        result = []
+        hits = []
+        statuses = []
+        for filename in filenames:
+            try:
+                status = self._status(filename)
+            except OSError:
+                result.append(filename)
+                continue
+            row = self.db.execute('SELECT status.digest FROM status JOIN clean '
+                                  'ON status.digest = clean.digest WHERE path = ? AND key = ? '
+                                  'AND device = ? AND inode = ? AND mtime = ? AND size = ?',
+                                  (status[0], self.key) + status[1:]).fetchone()
+            if row:
+                hits.append(row[0])
+                continue
+            digest = hashlib.blake2b((self.key + status[0] + file_digest(filename)).encode(
+                'utf-8', 'surrogateescape'), digest_size=20).hexdigest()
+            self.digests[filename] = status, digest
+            if self.db.execute('SELECT 1 FROM clean WHERE digest = ?', (digest,)).fetchone():
+                hits.append(digest)
+                statuses.append((status[0], self.key) + status[1:] + (digest,))
+            else:
+                result.append(filename)
+        now = time.time()
+        with self.db:
+            self.db.executemany('UPDATE clean SET used = ? WHERE digest = ?',
+                                [(now, digest) for digest in hits])
+            self.db.executemany('INSERT OR REPLACE INTO status VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                statuses)
+        return result
+
+    def add(self, filenames):
+        """Record that the files are normalised"""
+        import sqlite3
+        try:
+            self._add(filenames)
+        except sqlite3.Error:
+            pass
+
+    def _add(self, filenames):
+        now = time.time()
+        with self.db:
+            for filename in filenames:
+                if filename not in self.digests: continue
+                status, digest = self.digests.pop(filename)
+                self.db.execute('INSERT OR REPLACE INTO clean VALUES (?, ?)', (digest, now))
+                self.db.execute('INSERT OR REPLACE INTO status VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                (status[0], self.key) + status[1:] + (digest,))
+            count, = self.db.execute('SELECT COUNT(*) FROM clean').fetchone()
+            if count > self.max_entries:
+                self.db.execute('DELETE FROM clean WHERE digest IN (SELECT digest FROM clean '
+                                'ORDER BY used LIMIT ?)', (count - self.max_entries,))
+                self.db.execute('DELETE FROM status WHERE digest NOT IN (SELECT digest FROM clean)')
+
+def arguments_key(args):
+    """Return hook arguments that affect the result"""
+    return {k: v for k, v in vars(args).items() if k not in IGNORED_ARGUMENTS}
+
+def open_cache(hook, args, *key):
+    """Return result cache for the hook or None if caching is disabled or not possible"""
+    if args.no_cache: return None
+    import sqlite3
+    try:
+        return ResultCache(hook, [arguments_key(args), key])
+    except (OSError, sqlite3.Error):
+        return None
@@ -0,0 +1,69 @@
+import argparse
+import json
+import os
+import socket
+import sys
+
+def socket_path():
+    path = os.environ.get('PRE_COMMIT_CPP_SOCKET')
+    if path: return path
+    from pre_commit_hooks_cpp.cache import cache_dir
+    return os.path.join(cache_dir(), 'daemon.sock')
+
+def send(stream, header, content=None):
+    """Write JSON header line followed by the content bytes"""
+    header = dict(header, length=None if content is None else len(content))
+    stream.write(json.dumps(header).encode('utf-8') + b'\n')
+    if content is not None: stream.write(content)
+    stream.flush()
+
+def receive(stream):
+    """Read JSON header line and the content bytes that follow it"""
+    line = stream.readline()
+    if not line: raise ConnectionError('connection closed')
+    header = json.loads(line.decode('utf-8'))
+    content = None
+    if header.get('length') is not None:
+        content = stream.read(header['length'])
+        if len(content) != header['length']: raise ConnectionError('connection closed')
+    return header, content
+
+def request(path, argv, content):
+    """Send the request to the daemon and return its response"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.connect(path)
+        with s.makefile('rwb') as stream:
+            send(stream, {'argv': argv, 'cwd': os.getcwd()}, content)
+            return receive(stream)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Run cpp-hooks in the daemon or in this process if the daemon is not running',
+        epilog='Other arguments are the same as for cpp-hooks-daemon requests.', add_help=False)
+    parser.add_argument('--socket', default=None,
+                        help='Daemon socket (default: $PRE_COMMIT_CPP_SOCKET or daemon.sock '
+                        'in the cache directory)')
+    parser.add_argument('--no-daemon', action='store_true', help='Run in this process')
+    args, rest = parser.parse_known_args(argv)
+    content = None
+    if '--stdin-filename' in rest or any(a.startswith('--stdin-filename=') for a in rest):
+        content = sys.stdin.buffer.read()
+    header = None
+    if not args.no_daemon:
+        try:
+            header, new_content = request(args.socket or socket_path(), rest, content)
+        except (OSError, ValueError):
+            header = None
+    if header is None:
+        from pre_commit_hooks_cpp.daemon import Sessions
+        ret, output, new_content = Sessions().handle(rest, os.getcwd(), content)
+        header = {'ret': ret, 'output': output}
+    if content is None:
+        sys.stdout.write(header['output'])
+    else:
+        sys.stderr.write(header['output'])
+        if new_content is not None: sys.stdout.buffer.write(new_content)
+    return header['ret']
+
+if __name__ == '__main__':
+    exit(main())
@@ -0,0 +1,165 @@
+import argparse
+import copy
+import io
+import os
+import signal
+import socket
+import sys
+import time
+import traceback
+from contextlib import redirect_stderr, redirect_stdout
+
+from pre_commit_hooks_cpp import diff, driver, executor
+from pre_commit_hooks_cpp.client import receive, send, socket_path
+from pre_commit_hooks_cpp.files import write_result
+from pre_commit_hooks_cpp.git import git, head
+
+# arguments that do not affect the state of the hooks
+REQUEST_ARGUMENTS = {'filenames', 'stdin_filename', 'check', 'diff', 'all', 'jobs', 'timings',
+                     'timings_top', 'trace', 'profile'}
+# the state is rebuilt after this number of seconds
+MAX_AGE = 60
+
+class Session:
+    """Set up arguments and the state of the enabled hooks for one directory"""
+
+    def __init__(self, args):
+        diff.changed_lines.cache_clear()
+        self.args = args
+        self.states, _ = driver.setup(args)
+        self.head = head('.')
+        self.index = index_status() if args.changed_lines_only else None
+        self.created = time.monotonic()
+
+    def fresh(self, max_age):
+        return time.monotonic() - self.created < max_age and head('.') == self.head and \
+            (self.index is None or index_status() == self.index)
+
+    def request(self, args):
+        """Return the set up arguments with the per-request ones taken from args"""
+        result = copy.copy(self.args)
+        for name in REQUEST_ARGUMENTS: setattr(result, name, getattr(args, name))
+        return result
+
+    def run(self, filename, content, args):
+        """Normalise the buffer or the file and return the return code and the new content"""
+        buffer = content is not None
+        if not buffer:
+            with open(filename, 'rb') as f: content = f.read()
+        new_content = driver.apply(filename, content, args.enable, args, self.states)
+        if new_content == content: return 0, content
+        if not buffer: write_result(filename, content, new_content, args)
+        return 1, new_content
+
+def index_status():
+    """Return the modification time and the size of the git index"""
+    try:
+        s = os.stat(git('rev-parse', '--git-path', 'index').strip())
+    except OSError:
+        return None
+    return s.st_mtime_ns, s.st_size
+
+class Sessions:
+    """Warm states of the hooks (compiled regular expressions, source tree index, repository
+    history) keyed by the directory and the arguments"""
+
+    def __init__(self, max_age=MAX_AGE):
+        self.max_age = max_age
+        self.sessions = {}
+        self.parser = driver.make_parser('Run cpp-hooks in a long-lived process')
+        self.parser.add_argument('--stdin-filename',
+                                 help='Normalise the buffer read from standard input as if it '
+                                 'were this file and write it to standard output')
+
+    def session(self, args, cwd):
+        key = (cwd, repr(sorted((k, v) for k, v in vars(args).items()
+                                if k not in REQUEST_ARGUMENTS)))
+        session = self.sessions.get(key)
+        if session is None or not session.fresh(self.max_age):
+            session = self.sessions[key] = Session(args)
+        return session
+
+    def handle(self, argv, cwd, content=None):
+        """Process one request and return the return code, the output and the new content"""
+        output = io.StringIO()
+        new_content = None
+        old_cwd = os.getcwd()
+        try:
+            with redirect_stdout(output), redirect_stderr(output):
+                os.chdir(cwd)
+                args = self.parser.parse_args(argv)
+                if args.from_index is not None: self.parser.error('--from-index and --from-tree are not supported')
+                session = self.session(args, cwd)
+                args = session.request(args)
+                ret = 0
+                if args.stdin_filename is not None:
+                    ret, new_content = session.run(args.stdin_filename, content, args)
+                for filename in executor.select_files(self.parser, args,
+                                                      driver.extensions(args.enable)):
+                    ret |= session.run(filename, None, args)[0]
+        except SystemExit as e:
+            ret = e.code if isinstance(e.code, int) else 1
+        except Exception:
+            output.write(traceback.format_exc())
+            ret = 1
+        finally:
+            os.chdir(old_cwd)
+        return ret, output.getvalue(), new_content
+
+def running(path):
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            s.connect(path)
+        return True
+    except OSError:
+        return False
+
+def serve(path, sessions, idle_timeout):
+    if os.path.exists(path): os.remove(path)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+        server.bind(path)
+        os.chmod(path, 0o600)
+        server.listen()
+        server.settimeout(idle_timeout)
+        try:
+            while True:
+                try:
+                    connection, _ = server.accept()
+                except socket.timeout:
+                    break
+                with connection, connection.makefile('rwb') as stream:
+                    try:
+                        header, content = receive(stream)
+                        ret, output, new_content = sessions.handle(header['argv'], header['cwd'],
+                                                                   content)
+                        send(stream, {'ret': ret, 'output': output}, new_content)
+                    except (OSError, ValueError, KeyError):
+                        pass
+        finally:
+            os.remove(path)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Keep the state of the hooks warm and serve '
+                                     'cpp-hooks-client requests on a Unix socket')
+    parser.add_argument('--socket', default=None,
+                        help='Socket path (default: $PRE_COMMIT_CPP_SOCKET or daemon.sock '
+                        'in the cache directory)')
+    parser.add_argument('--idle-timeout', help='Exit after this number of idle seconds',
+                        default=3600, type=float)
+    parser.add_argument('--max-age', help='Rebuild the state after this number of seconds '
+                        'or when HEAD changes', default=MAX_AGE, type=float)
+    args = parser.parse_args(argv)
+    path = args.socket or socket_path()
+    if running(path):
+        print('{}: daemon is already running'.format(path), file=sys.stderr)
+        return 1
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        serve(path, Sessions(args.max_age), args.idle_timeout)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == '__main__':
+    exit(main())
@@ -0,0 +1,77 @@
+import codecs
+import os
+from bisect import bisect_left
+from functools import lru_cache
+
+from pre_commit_hooks_cpp.regex import LazyRegex
+
+HUNK = LazyRegex(rb'^@@ -\d+(?:,\d+)? \+(\d+)(?:,(\d+))? @@')
+
+class LineRanges:
+    """Sorted non-overlapping ranges of line numbers (1-based, inclusive)"""
+
+    def __init__(self, ranges=()):
+        self.ranges = list(ranges)
+        self.ends = [end for _, end in self.ranges]
+
+    def overlaps(self, first, last):
+        i = bisect_left(self.ends, first)
+        return i < len(self.ranges) and self.ranges[i][0] <= last
+
+    def __contains__(self, line_no):
+        return self.overlaps(line_no, line_no)
+
+    def __iter__(self):
+        return iter(self.ranges)
+
+    def __bool__(self):
+        return bool(self.ranges)
+
+    def __repr__(self):
+        return repr(self.ranges)
+
+def unquote(path):
+    """Remove C-style quotes that git puts around unusual paths"""
+    if not path.startswith(b'"'): return path
+    return codecs.escape_decode(path[1:-1])[0]
+
+def read_changed_lines():
+    """Return staged line ranges of each file with the paths relative to the current directory"""
+    from pre_commit_hooks_cpp.git import git_stream
+    process = git_stream('diff', '--cached', '-U0', '--relative', '--no-color', '--no-ext-diff',
+                         '--src-prefix=a/', '--dst-prefix=b/')
+    result = {}
+    ranges = None
+    for line in process.stdout:
+        if line.startswith(b'+++ '):
+            path = line[4:].rstrip(b'\n')
+            if path.endswith(b'\t'): path = path[:-1]
+            path = unquote(path)
+            ranges = None
+            if path.startswith(b'b/'):
+                ranges = result.setdefault(path[2:].decode('utf-8', 'surrogateescape'), [])
+            continue
+        m = HUNK.match(line)
+        if m is None or ranges is None: continue
+        start = int(m.group(1))
+        count = 1 if m.group(2) is None else int(m.group(2))
+        if count: ranges.append((start, start + count - 1))
+    process.wait()
+    return {path: LineRanges(ranges) for path, ranges in result.items()}
+
+@lru_cache(maxsize=1)
+def changed_lines():
+    """Read the staged diff once for all hooks (cache_clear() to read it again)"""
+    return read_changed_lines()
+
+def file_ranges(changed, filename):
+    """Return changed lines of the file or None if all lines should be processed"""
+    if changed is None: return None
+    return changed.get(os.path.normpath(filename).replace(os.sep, '/'), LineRanges())
+
+def add_arguments(parser):
+    parser.add_argument('--changed-lines-only', action='store_true',
+                        help='Process only the lines changed in the index (git diff --cached)')
+
+def setup(args):
+    return changed_lines() if args.changed_lines_only else None
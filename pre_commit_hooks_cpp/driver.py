@@ -0,0 +1,142 @@
+import argparse
+import importlib
+import os
+
+from pre_commit_hooks_cpp import blobs, executor, timings
+from pre_commit_hooks_cpp.files import extension_matcher, print_diff, verdict_only, \
+    write_atomic, write_result
+
+# hooks in the order in which they are applied to each file
+HOOKS = ['normalise', 'header-guard', 'normalise-opencl', 'normalise-cpp', 'legal']
+
+def hook_module(name):
+    return importlib.import_module('pre_commit_hooks_cpp.' + name.replace('-', '_'))
+
+def hook_list(text):
+    names = [name.strip() for name in text.split(',') if name.strip()]
+    unknown = set(names) - set(HOOKS)
+    if unknown: raise argparse.ArgumentTypeError("unknown hooks: %s" % ', '.join(sorted(unknown)))
+    return [name for name in HOOKS if name in names]
+
+def decode(content):
+    """Decode the content the same way as text-mode files do"""
+    return content.decode('utf-8', 'surrogateescape').replace('\r\n', '\n').replace('\r', '\n')
+
+def apply(filename, content, hooks, args, states):
+    """Pass the content through the hooks and return the new content.
+
+    normalise hook transforms bytes, and the other hooks transform the text, that is decoded
+    only once. Each hook is applied only to the files with the extensions that it processes.
+    If only the verdict is needed, the hooks after the first one that changes the file are
+    skipped.
+    """
+    extension = os.path.splitext(filename)[1]
+    stop = verdict_only(args)
+    text = None
+    new_text = None
+    for name in hooks:
+        module = hook_module(name)
+        if module.EXTENSIONS is not None and extension not in module.EXTENSIONS: continue
+        if name == 'normalise':
+            new_content = module.apply(filename, content, args, *states[name])
+            if stop and new_content != content: return new_content
+            content = new_content
+            continue
+        if text is None:
+            text = decode(content)
+            new_text = text
+        new_text = module.apply(filename, new_text, args, *states[name])
+        if stop and new_text != text: break
+    if new_text != text: content = new_text.encode('utf-8', 'surrogateescape')
+    return content
+
+def process(filename, hooks, args, states):
+    content = None
+    with timings.stage('read'), open(filename, 'rb') as f: content = f.read()
+    new_content = apply(filename, content, hooks, args, states)
+    if new_content == content: return 0
+    write_result(filename, content, new_content, args)
+    return 1
+
+def worktree_equals(filename, content):
+    try:
+        with open(filename, 'rb') as f: return f.read() == content
+    except OSError:
+        return False
+
+def process_blob(entry, hooks, args, states):
+    """Check the staged blob or the blob from the tree and return the updated index entry.
+
+    The file in the worktree is updated only if it is the same as the staged blob.
+    """
+    mode, oid, filename = entry
+    content = blobs.read_blob(oid)
+    new_content = apply(filename, content, hooks, args, states)
+    if new_content == content: return 0, None
+    if args.diff: print_diff(filename, content, new_content)
+    if args.from_index != blobs.INDEX or args.check or args.diff: return 1, None
+    new_oid = blobs.write_blob(new_content)
+    if worktree_equals(filename, content): write_atomic(filename, new_content)
+    return 1, (mode, new_oid, filename)
+
+def extensions(hooks):
+    """Return the extensions of the files that any of the hooks processes (None for all files)"""
+    result = set()
+    for name in hooks:
+        module = hook_module(name)
+        if module.EXTENSIONS is None: return None
+        result |= module.EXTENSIONS
+    return result
+
+def make_parser(description='Run several hooks reading and writing each file once'):
+    parser = argparse.ArgumentParser(description=description, conflict_handler='resolve')
+    parser.add_argument('filenames', nargs='*', help='Filenames to check')
+    parser.add_argument('--enable', help='Comma-separated list of hooks (default: all)',
+                        default=list(HOOKS), type=hook_list)
+    parser.add_argument('--from-index', action='store_const', const=blobs.INDEX,
+                        help='Check the staged files instead of the files in the worktree '
+                        'and fix them in the index')
+    parser.add_argument('--from-tree', dest='from_index', metavar='TREEISH',
+                        help='Check the files from the tree (e.g. a pushed commit) '
+                        'without fixing them')
+    for name in HOOKS:
+        hook_module(name).add_arguments(parser)
+    executor.add_arguments(parser)
+    return parser
+
+def setup(args):
+    """Return the state of every enabled hook and the result cache key"""
+    states = {}
+    key = []
+    for name in args.enable:
+        module = hook_module(name)
+        states[name] = module.setup(args)
+        if hasattr(module, 'cache_key'): key += module.cache_key(*states[name])
+    return states, key
+
+def main(argv=None):
+    parser = make_parser()
+    args = parser.parse_args(argv)
+    if not (args.filenames or args.all): return 0
+    timings.start(args)
+    states, key = setup(args)
+    filenames = executor.select_files(parser, args, extensions(args.enable))
+    if args.from_index is not None:
+        try:
+            if args.all:
+                matches = extension_matcher(extensions(args.enable))
+                entries = [e for e in blobs.entries(args.from_index, None) if matches(e[2])]
+            else:
+                entries = blobs.entries(args.from_index, filenames)
+        except ValueError as e:
+            parser.error(str(e))
+        updates = []
+        ret = executor.run(process_blob, entries, args.jobs, args.enable, args, states,
+                           results=updates)
+        blobs.update_index([entry for _, entry in updates])
+        return ret
+    cache = executor.open_cache('cpp-hooks', args, *key)
+    return executor.run(process, filenames, args.jobs, args.enable, args, states, cache=cache)
+
+if __name__ == '__main__':
+    exit(main())
@@ -0,0 +1,111 @@
+import argparse
+import io
+import os
+import sys
+from collections import deque
+from itertools import chain, islice
+from contextlib import redirect_stdout
+
+from pre_commit_hooks_cpp import timings
+from pre_commit_hooks_cpp.files import write_stdout
+
+_function = None
+_args = ()
+
+def _initialise(function, args, timing):
+    global _function, _args
+    _function = function
+    _args = args
+    if timing and not timings.enabled(): timings.enable()
+
+def _call(filename):
+    output = io.TextIOWrapper(io.BytesIO(), sys.stdout.encoding, sys.stdout.errors,
+                              write_through=True)
+    with redirect_stdout(output), timings.file(filename):
+        ret = _function(filename, *_args)
+    return ret, output.buffer.getvalue(), timings.pop()
+
+def _split(ret, filename, results):
+    if results is None: return ret
+    ret, result = ret
+    if result is not None: results.append((filename, result))
+    return ret
+
+def int_positive(text):
+    i = int(text)
+    if i <= 0: raise argparse.ArgumentTypeError("%s must be positive" % text)
+    return i
+
+def add_arguments(parser):
+    parser.add_argument('-j', '--jobs', help='Number of parallel processes (default: CPU count)',
+                        default=os.cpu_count() or 1, type=int_positive)
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Process all files, including the ones that were normalised before')
+    parser.add_argument('--all', action='store_true',
+                        help='Process all files tracked by git that the hook accepts')
+    parser.add_argument('--check', action='store_true',
+                        help='Report the files that need fixing without changing them')
+    parser.add_argument('--diff', action='store_true',
+                        help='Print unified diff of the fixes without changing the files')
+    timings.add_arguments(parser)
+
+def select_files(parser, args, extensions):
+    """Return the filenames or, with --all, a generator of the tracked files that have the
+    extensions"""
+    if not args.all: return args.filenames
+    if args.filenames: parser.error('--all and filenames are mutually exclusive')
+    from pre_commit_hooks_cpp.files import extension_matcher
+    from pre_commit_hooks_cpp.git import tracked_files
+    matches = extension_matcher(extensions)
+    # files deleted in the worktree are still tracked
+    return (f for f in tracked_files() if matches(f) and os.path.isfile(f))
+
+def run(function, filenames, jobs, *args, cache=None, results=None):
+    """Call function(filename, *args) for each file and return bitwise OR of the return codes.
+
+    Files are processed in a pool of worker processes. The output of each call is captured
+    and printed in the order of filenames, so that it is the same as in the serial run.
+    filenames may be a generator, files are submitted to the pool as they come.
+    Files found in the result cache are skipped, and the files for which the function
+    returned zero are added to the cache. If results list is given, the function returns
+    a (return code, result) pair and the results that are not None are appended to the list.
+    """
+    ret = 0
+    filenames = iter(filenames)
+    if cache is not None: filenames = cache.filter_stream(filenames)
+    first = list(islice(filenames, jobs))
+    filenames = chain(first, filenames)
+    clean = []
+    if jobs == 1 or len(first) <= 1:
+        for filename in filenames:
+            with timings.file(filename):
+                r = _split(function(filename, *args), filename, results)
+            if r == 0: clean.append(filename)
+            ret |= r
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        window = 4*jobs
+        with ProcessPoolExecutor(len(first), initializer=_initialise,
+                                 initargs=(function, args, timings.enabled())) as pool:
+            pending = deque()
+            for filename in filenames:
+                pending.append((filename, pool.submit(_call, filename)))
+                if len(pending) < window: continue
+                ret |= _result(*pending.popleft(), clean, results)
+            while pending:
+                ret |= _result(*pending.popleft(), clean, results)
+    if cache is not None: cache.add(clean)
+    return ret
+
+def _result(filename, future, clean, results):
+    ret, output, records = future.result()
+    write_stdout(output)
+    timings.extend(records)
+    ret = _split(ret, filename, results)
+    if ret == 0: clean.append(filename)
+    return ret
+
+def open_cache(hook, args, *key):
+    """Return the result cache of the hook unless disabled with --no-cache"""
+    from pre_commit_hooks_cpp.cache import open_cache
+    return open_cache(hook, args, *key)
@@ -0,0 +1,127 @@
+import codecs
+import io
+import mmap
+import os
+import sys
+
+from pre_commit_hooks_cpp import timings
+
+# files larger than this are processed in chunks
+STREAM_THRESHOLD = 64*1024*1024
+CHUNK_SIZE = 1024*1024
+
+class AtomicFile:
+    """Temporary file that replaces the original file on commit and is removed otherwise"""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.committed = False
+        import tempfile
+        directory = os.path.dirname(os.path.abspath(filename))
+        self.file = tempfile.NamedTemporaryFile('wb', dir=directory, delete=False)
+
+    def commit(self):
+        self.committed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.file.close()
+        if self.committed and exc_type is None:
+            import shutil
+            if os.path.exists(self.filename): shutil.copymode(self.filename, self.file.name)
+            os.replace(self.file.name, self.filename)
+        else:
+            os.remove(self.file.name)
+
+def write_atomic(filename, content):
+    """Write bytes to a temporary file and rename it to filename preserving file mode"""
+    with timings.stage('write'), AtomicFile(filename) as f:
+        f.file.write(content)
+        f.commit()
+
+def extension_matcher(extensions):
+    """Return a function that tells if the filename has one of the extensions (None matches
+    all files)"""
+    if extensions is None: return lambda filename: True
+    suffixes = tuple(e for e in extensions if e)
+    if '' not in extensions: return lambda filename: filename.endswith(suffixes)
+    return lambda filename: os.path.splitext(filename)[1] in extensions
+
+def encode(content):
+    """Return the bytes of the content (text in the same encoding as the files opened in text
+    mode)"""
+    if isinstance(content, bytes): return content
+    import locale
+    return content.encode(locale.getpreferredencoding(False), 'surrogateescape')
+
+def write_stdout(data):
+    """Write bytes to standard output after the text printed so far (escape sequences if it
+    has no binary buffer)"""
+    buffer = getattr(sys.stdout, 'buffer', None)
+    if buffer is None:
+        sys.stdout.write(data.decode(sys.stdout.encoding or 'utf-8', 'backslashreplace'))
+        return
+    sys.stdout.flush()
+    buffer.write(data)
+
+def print_diff(filename, content, new_content):
+    """Print unified diff of the content as raw bytes, so that git apply accepts it in any
+    encoding"""
+    import difflib
+    path = os.fsencode(filename.replace(os.sep, '/'))
+    lines = []
+    for line in difflib.diff_bytes(difflib.unified_diff, encode(content).splitlines(True),
+                                   encode(new_content).splitlines(True),
+                                   b'a/' + path, b'b/' + path):
+        if not line.endswith(b'\n'): line += b'\n\\ No newline at end of file\n'
+        lines.append(line)
+    write_stdout(b''.join(lines))
+
+def verdict_only(args):
+    """Return True if only the verdict is needed, so that hooks can stop at the first change"""
+    return args.check and not args.diff
+
+def write_result(filename, content, new_content, args):
+    """Print the diff with --diff and write the new content unless --check or --diff is given"""
+    if args.diff: print_diff(filename, content, new_content)
+    if args.check or args.diff: return
+    write_atomic(filename, encode(new_content))
+
+def read_json(filename):
+    """Return the data stored in JSON file or None if it cannot be read"""
+    import json
+    try:
+        with open(filename) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def write_json_atomic(filename, data):
+    """Write the data to JSON file through a temporary file"""
+    import json
+    os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+    with AtomicFile(filename) as f:
+        f.file.write(json.dumps(data, separators=(',', ':')).encode('utf-8'))
+        f.commit()
+
+def chunks(content, offset=0, size=CHUNK_SIZE):
+    """Split bytes or memory-mapped file into chunks of at most size bytes"""
+    for i in range(offset, len(content), size):
+        yield content[i:i+size]
+
+def map_file(filename):
+    """Memory-map the file for reading"""
+    with open(filename, 'rb') as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+def decode_chunks(content, encoding, errors='strict', offset=0, size=CHUNK_SIZE):
+    """Decode bytes or memory-mapped file chunk by chunk translating line endings"""
+    decoder = codecs.getincrementaldecoder(encoding)(errors)
+    decoder = io.IncrementalNewlineDecoder(decoder, translate=True)
+    for c in chunks(content, offset, size):
+        text = decoder.decode(c)
+        if text: yield text
+    text = decoder.decode(b'', final=True)
+    if text: yield text
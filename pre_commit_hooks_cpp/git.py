@@ -0,0 +1,61 @@
+import os
+import subprocess
+
+from pre_commit_hooks_cpp import timings
+
+def git(*args):
+    """Run git command and return its standard output as a string"""
+    with timings.subprocess():
+        result = subprocess.run(['git', '--no-pager'] + list(args), stdout=subprocess.PIPE)
+    return result.stdout.decode('utf-8', 'surrogateescape')
+
+def git_succeeds(*args):
+    """Run git command and return true if it exits with zero status"""
+    with timings.subprocess():
+        result = subprocess.run(['git', '--no-pager'] + list(args),
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return result.returncode == 0
+
+def git_stream(*args):
+    """Start git command with its standard output connected to a pipe"""
+    timings.count('subprocesses')
+    return subprocess.Popen(['git', '--no-pager'] + list(args), stdout=subprocess.PIPE)
+
+def split_nul(stream, size=65536):
+    """Split binary stream into NUL-terminated tokens without reading it all into memory"""
+    rest = b''
+    while True:
+        chunk = stream.read(size)
+        if not chunk: break
+        tokens = (rest + chunk).split(b'\0')
+        rest = tokens.pop()
+        for token in tokens:
+            yield token.decode('utf-8', 'surrogateescape')
+    if rest: yield rest.decode('utf-8', 'surrogateescape')
+
+def tracked_files():
+    """Yield the regular files tracked by git relative to the current directory"""
+    process = git_stream('ls-files', '-s', '-z')
+    previous = None
+    for token in split_nul(process.stdout):
+        info, path = token.split('\t', 1)
+        # skip submodules, symbolic links and the other stages of unmerged files
+        if path == previous or info.startswith(('160000', '120000')): continue
+        previous = path
+        yield path
+    process.wait()
+
+def toplevel():
+    return git('rev-parse', '--show-toplevel').strip()
+
+def git_dir(top):
+    """Return the directory shared by all worktrees of the repository"""
+    return os.path.join(top, git('-C', top, 'rev-parse', '--git-common-dir').strip())
+
+def head(top):
+    """Return HEAD commit hash or an empty string for a repository without commits"""
+    return git('-C', top, 'rev-parse', '--verify', '-q', 'HEAD').strip()
+
+def relative_to(top, filename):
+    """Convert filename to the path relative to the top-level directory as printed by git"""
+    return os.path.relpath(os.path.abspath(filename), top).replace(os.sep, '/')
@@ -0,0 +1,70 @@
+import os
+
+from pre_commit_hooks_cpp.cache import load_index, update_entries
+from pre_commit_hooks_cpp.files import extension_matcher
+from pre_commit_hooks_cpp.git import tracked_files
+from pre_commit_hooks_cpp.header_guard import HEADER_EXTENSIONS, find_guard, guard_name, \
+    read_prologue
+
+def headers():
+    """Return the headers tracked by git relative to the current directory"""
+    matches = extension_matcher(HEADER_EXTENSIONS)
+    return [f for f in tracked_files() if matches(f)]
+
+def scan(filename):
+    """Return the status of the header and its guard names (or None if there is no guard)"""
+    s = os.stat(filename)
+    m = find_guard(read_prologue(filename))
+    return 0, [s.st_mtime_ns, s.st_size, list(m.groups()) if m else None]
+
+class GuardIndex:
+    """Header guards of all headers in the repository read from their prologues"""
+
+    def __init__(self, entries=None):
+        self.entries = entries or {}
+
+    def update(self, filenames, jobs):
+        entries = update_entries(self.entries, filenames, jobs, scan)
+        modified = entries != self.entries
+        self.entries = entries
+        return modified
+
+    def guards(self):
+        """Return guard name to paths mapping"""
+        result = {}
+        for filename, (_, _, guard) in self.entries.items():
+            if guard is not None: result.setdefault(guard[0], []).append(filename)
+        return result
+
+    def collisions(self):
+        return {name: sorted(paths) for name, paths in self.guards().items() if len(paths) > 1}
+
+    def stale(self):
+        """Return headers without guards or with the guards that do not match their paths"""
+        return sorted(filename for filename, (_, _, guard) in self.entries.items()
+                      if guard is None or guard[0] != guard[1] or
+                      guard[0] != guard_name(filename))
+
+def load(jobs, persist=True):
+    """Build the index of the tracked headers, refreshing the persisted one if requested"""
+    def update(entries):
+        index = GuardIndex(entries if isinstance(entries, dict) else None)
+        return index, index.entries if index.update(headers(), jobs) else None
+    return load_index('guards', os.getcwd(), persist, update)
+
+def report(index, filenames):
+    """Print guard collisions that involve the files (all collisions and stale guards if there
+    are no files) and return non-zero if anything is printed"""
+    ret = 0
+    selected = set(os.path.normpath(f).replace(os.sep, '/') for f in filenames)
+    for name, paths in sorted(index.collisions().items()):
+        if selected and selected.isdisjoint(paths): continue
+        print('{}: header guard is used in {}'.format(name, ', '.join(paths)))
+        ret = 1
+    if not selected:
+        for filename in index.stale():
+            guard = index.entries[filename][2]
+            if guard is None: print('{}: no header guard'.format(filename))
+            else: print('{}: stale header guard {}'.format(filename, guard[0]))
+            ret = 1
+    return ret
@@ -2,9 +2,21 @@ import argparse
 import os
 import re
 
+from pre_commit_hooks_cpp import executor, timings
+from pre_commit_hooks_cpp.files import write_result
+from pre_commit_hooks_cpp.regex import LazyRegex
+
 # from GCC documentation
 CPP_HEADER_EXTENSIONS = {'.hh', '.H', '.hp', '.hxx', '.hpp', '.HPP', '.h++', '.tcc', ''}
 C_HEADER_EXTENSIONS = {'.h'}
+CPP_SOURCE_EXTENSIONS = {'.cc', '.cp', '.cxx', '.cpp', '.CPP', '.c++', '.C'}
+HEADER_EXTENSIONS = (CPP_HEADER_EXTENSIONS | C_HEADER_EXTENSIONS) - {''}
+# files that the hook processes
+EXTENSIONS = HEADER_EXTENSIONS
+GUARD = LazyRegex(r'#ifndef\s+([a-zA-Z_][a-zA-Z0-9_]*)\s*\n\s*#define\s+([a-zA-Z_][a-zA-Z0-9_]*)\s*\n')
+# byte order mark, blank lines, comments and pragmas (e.g. #pragma once) before the header guard
+PROLOGUE = LazyRegex(r'\ufeff?(?:\s+|//[^\n]*|/\*.*?\*/|#[^\S\n]*pragma\b[^\n]*)*', re.S)
+PROLOGUE_SIZE = 8192
 
 def guard_name(filename):
     name = filename
@@ -21,45 +33,84 @@ def vim_file_type(filename):
     if extension in C_HEADER_EXTENSIONS: return 'c'
     return None
 
+def find_guard(contents):
+    """Match the header guard that follows blank lines, comments and pragmas at the beginning"""
+    return GUARD.match(contents, PROLOGUE.match(contents).end())
+
+def prologue_complete(contents):
+    """Return true if the header guard can be found without reading further"""
+    rest = contents[PROLOGUE.match(contents).end():]
+    return not rest.startswith('/*') and rest.count('\n') >= 2
+
+def read_prologue(filename):
+    """Read only the beginning of the file that is enough to find the header guard"""
+    contents = b''
+    size = PROLOGUE_SIZE
+    with open(filename, 'rb') as f:
+        while True:
+            chunk = f.read(size)
+            contents += chunk
+            text = contents.decode('utf-8', 'surrogateescape')
+            if not chunk or prologue_complete(text): return text
+            size *= 2
+
+def add_header_guard(filename, contents):
+    """Return the contents with the header guard added or renamed"""
+    name = guard_name(filename)
+    with timings.stage('header-guard:find'):
+        m = find_guard(contents)
+    if m:
+        name1 = m.group(1)
+        name2 = m.group(2)
+        if name1 == name2 and name1 != name:
+            # update header guard
+            contents = (contents[:m.start(1)] + name + contents[m.end(1):m.start(2)] + name +
+                        contents[m.end(2):])
+            print('{}: rename header guard'.format(filename))
+    else:
+        # add header guard
+        contents = '#ifndef ' + name + '\n#define ' + name + '\n\n' + contents + '\n#endif'
+        filetype = vim_file_type(filename)
+        if filetype is not None:
+            contents += ' // vim' + ':filetype=' + filetype
+        contents += '\n'
+        print('{}: add header guard'.format(filename))
+    return contents
+
+def header_guard(filename, args):
+    contents = None
+    with open(filename) as f:
+        contents = f.read();
+    new_contents = add_header_guard(filename, contents)
+    if new_contents == contents: return 0
+    write_result(filename, contents, new_contents, args)
+    return 1
+
+def add_arguments(parser):
+    pass
+
+def setup(args):
+    return ()
+
+def apply(filename, content, args):
+    return add_header_guard(filename, content)
+
 def main(argv=None):
     parser = argparse.ArgumentParser(description='Check and add C/C++ header guard')
     parser.add_argument('filenames', nargs='*', help='Filenames to check')
+    parser.add_argument('--guard-index', action='store_true',
+                        help='Report header guards that are used in more than one header '
+                        '(and stale guards if no files are given)')
+    executor.add_arguments(parser)
     args = parser.parse_args(argv)
-    guard = re.compile(r'#ifndef\s+([a-zA-Z_][a-zA-Z0-9_]*)\s*\n\s*#define\s+([a-zA-Z_][a-zA-Z0-9_]*)\s*\n')
-    ret = 0
-    for filename in args.filenames:
-        contents = None
-        with open(filename) as f:
-            contents = f.read();
-        name = guard_name(filename)
-        m = list(guard.finditer(contents))
-        if m:
-            m = m[0]
-            name1 = m.group(1)
-            name2 = m.group(2)
-            if name1 == name2 and name1 != name:
-                # update header guard
-                with open(filename, 'w') as f:
-                    f.write(contents[:m.start(1)])
-                    f.write(name)
-                    f.write(contents[m.end(1):m.start(2)])
-                    f.write(name)
-                    f.write(contents[m.end(2):])
-                print('{}: rename header guard'.format(filename))
-                ret = 1
-        else:
-            # add header guard
-            with open(filename, 'w') as f:
-                f.write('#ifndef ' + name + '\n#define ' + name + '\n\n')
-                f.write(contents)
-                f.write('\n#endif')
-                filetype = vim_file_type(filename)
-                if filename is not None:
-                    f.write(' // vim' + ':filetype=')
-                    f.write(filetype)
-                f.write('\n')
-            print('{}: add header guard'.format(filename))
-            ret = 1
+    timings.start(args)
+    ret = executor.run(header_guard, executor.select_files(parser, args, EXTENSIONS),
+                       args.jobs, args,
+                       cache=executor.open_cache('header-guard', args))
+    if args.guard_index:
+        from pre_commit_hooks_cpp import guard_index
+        ret |= guard_index.report(guard_index.load(args.jobs, persist=not args.no_cache),
+                                  args.filenames)
     return ret
 
 if __name__ == '__main__':
@@ -0,0 +1,123 @@
+import os
+from datetime import datetime
+
+from pre_commit_hooks_cpp.files import read_json, write_json_atomic
+from pre_commit_hooks_cpp.git import git, git_dir, git_stream, git_succeeds, head, split_nul, \
+    toplevel, relative_to
+
+LOG = ['log', '--name-status', '-M', '-z', '--pretty=format:%x01%an|%ad', '--date=format:%Y']
+CACHE_VERSION = 1
+CACHE_MAX_PATHS = 500000
+
+def log_entries(tokens):
+    """Parse the output of `git log --name-status -z` into (author, year, status, paths) tuples"""
+    author = None
+    year = None
+    for token in tokens:
+        if token.startswith('\x01'):
+            header, _, token = token[1:].partition('\n')
+            author, _, year = header.rpartition('|')
+        if not token: continue
+        status = token[0]
+        if status in 'RC': paths = (next(tokens), next(tokens))
+        else: paths = (next(tokens),)
+        yield author, year, status, paths
+
+class History:
+    """Authors and years of modification of every file in the repository.
+
+    The history is read in one pass over `git log` output from the newest commit to the oldest
+    one. When a renamed file is encountered, the older commits that touch the old path are
+    attributed to the new path, which is what `git log --follow` does for a single file.
+    """
+
+    def __init__(self, top=None):
+        self.top = top if top is not None else toplevel()
+        self.paths = {}
+        self._username = None
+
+    def read(self, *revisions):
+        """Add commits from the revision range and return the mapping of old names to new names"""
+        process = git_stream('-C', self.top, *LOG, *revisions)
+        names = {}
+        for author, year, status, paths in log_entries(split_nul(process.stdout)):
+            path = names.get(paths[-1], paths[-1])
+            self.paths.setdefault(path, {}).setdefault(author, set()).add(year)
+            if status == 'R': names[paths[0]] = path
+        process.wait()
+        return names
+
+    def merge(self, paths, names):
+        """Add older history that precedes the renames recorded in names"""
+        for path, authors in paths.items():
+            path = names.get(path, path)
+            current = self.paths.setdefault(path, {})
+            for author, years in authors.items():
+                current.setdefault(author, set()).update(years)
+
+    def username(self):
+        if self._username is None:
+            self._username = git('config', 'user.name').strip()
+        return self._username
+
+    def authors(self, filename):
+        """Return the mapping of author names to the sets of years for the file"""
+        authors = self.paths.get(relative_to(self.top, filename))
+        if not authors:
+            authors = {self.username(): {datetime.now().strftime("%Y")}}
+        return authors
+
+def cache_filename(top):
+    return os.path.join(git_dir(top), 'pre-commit-cpp', 'history.json')
+
+def read_cache(filename):
+    """Return the commit the cache was computed at and the per-path author data"""
+    data = read_json(filename)
+    if not isinstance(data, dict) or data.get('version') != CACHE_VERSION: return None, {}
+    paths = {}
+    for path, authors in data['paths'].items():
+        paths[path] = {author: set(years) for author, years in authors.items()}
+    return data['head'], paths
+
+def write_cache(filename, commit, paths, top):
+    if len(paths) > CACHE_MAX_PATHS:
+        # forget files that were deleted from the working tree
+        paths = {p: a for p, a in paths.items() if os.path.exists(os.path.join(top, p))}
+    if len(paths) > CACHE_MAX_PATHS:
+        if os.path.exists(filename): os.remove(filename)
+        return
+    data = {
+        'version': CACHE_VERSION,
+        'head': commit,
+        'paths': {p: {a: sorted(y) for a, y in authors.items()} for p, authors in paths.items()},
+    }
+    write_json_atomic(filename, data)
+
+def load(top=None, cache=True):
+    """Read repository history reusing the cache from the previous run.
+
+    Only the commits between the cached commit and HEAD are read. The cache is discarded
+    when the cached commit is no longer an ancestor of HEAD (i.e. history was rewritten).
+    """
+    history = History(top)
+    commit = head(history.top)
+    if not commit: return history
+    if not cache:
+        history.read(commit)
+        return history
+    filename = cache_filename(history.top)
+    cached_commit, paths = read_cache(filename)
+    if cached_commit == commit:
+        history.paths = paths
+        return history
+    if cached_commit and git_succeeds('-C', history.top, 'merge-base', '--is-ancestor',
+                                      cached_commit, commit):
+        names = history.read(cached_commit + '..' + commit)
+        history.merge(paths, names)
+    else:
+        history.read(commit)
+    try:
+        write_cache(filename, commit, history.paths, history.top)
+    except OSError:
+        pass
+    return history
@@ -0,0 +1,252 @@
+import hashlib
+import io
+import os
+from collections import namedtuple
+from functools import lru_cache
+
+from pre_commit_hooks_cpp.cache import load_index, update_entries
+from pre_commit_hooks_cpp.files import extension_matcher
+from pre_commit_hooks_cpp.header_guard import HEADER_EXTENSIONS, CPP_SOURCE_EXTENSIONS
+from pre_commit_hooks_cpp.regex import LazyRegex
+
+INCLUDE_RELATIVE = LazyRegex(r'\s*#include\s+"([^"]+)"\s*\n')
+INCLUDE_SYSTEM = LazyRegex(r'\s*#include\s+<([^>]+)>\s*\n')
+# files that are added to the include graph
+EXTENSIONS = HEADER_EXTENSIONS | CPP_SOURCE_EXTENSIONS
+
+# include directive: line index, True for <path> and False for "path", path as written
+Include = namedtuple('Include', ['index', 'system', 'path'])
+
+def parse_line(line, index=0):
+    """Return the include directive of the line or None"""
+    if '#include' not in line: return None
+    m = INCLUDE_SYSTEM.match(line)
+    if m: return Include(index, True, m.group(1))
+    m = INCLUDE_RELATIVE.match(line)
+    if m: return Include(index, False, m.group(1))
+    return None
+
+def parse(lines):
+    """Return the include directives of the lines"""
+    result = []
+    for i,line in enumerate(lines):
+        include = parse_line(line, i)
+        if include is not None: result.append(include)
+    return result
+
+@lru_cache(maxsize=16)
+def top_order(top_headers):
+    """Return the mapping of the headers that must be at the top to their positions"""
+    order = {}
+    for name in top_headers: order.setdefault(name, len(order))
+    return order
+
+def sort_block(block, top):
+    """Return the lines of (line, path) block with the top headers first, the other headers
+    sorted and the duplicate includes removed"""
+    lines = {}
+    for line, path in block: lines.setdefault(path, line)
+    head = sorted((path for path in lines if path in top), key=top.get)
+    return [lines[path] for path in head] + \
+        sorted(line for path, line in lines.items() if path not in top)
+
+def sort_blocks(lines, includes, top, ranges=None):
+    """Return the lines with each block of consecutive system includes sorted (only the blocks
+    that contain changed lines if ranges are given)"""
+    result = []
+    position = 0
+    block = []
+    for include in includes + [None]:
+        if include is not None and include.system and \
+           (not block or block[-1].index + 1 == include.index):
+            block.append(include)
+            continue
+        if block:
+            first = block[0].index
+            last = block[-1].index
+            result.extend(lines[position:first])
+            if ranges is None or ranges.overlaps(first+1, last+1):
+                result.extend(sort_block([(lines[i.index].lstrip(), i.path) for i in block], top))
+            else:
+                result.extend(lines[first:last+1])
+            position = last + 1
+        block = [include] if include is not None and include.system else []
+    result.extend(lines[position:])
+    return result
+
+def scan(filename, src, known):
+    """Return the status and the digest of the file and its includes (None if the digest is
+    known)"""
+    path = os.path.join(src, filename)
+    s = os.stat(path)
+    with open(path, 'rb') as f: content = f.read()
+    digest = hashlib.blake2b(content, digest_size=20).hexdigest()
+    includes = None
+    if digest not in known:
+        text = content.decode('utf-8', 'surrogateescape')
+        lines = io.StringIO(text, newline=None).readlines()
+        includes = [[include.system, include.path] for include in parse(lines)]
+    return 0, [s.st_mtime_ns, s.st_size, digest, includes]
+
+class IncludeGraph:
+    """Includes of all C/C++ files in the source directory keyed by content digests"""
+
+    def __init__(self, src, files=None, includes=None):
+        self.src = src
+        self.files = files or {}
+        self.includes = includes or {}
+
+    def update(self, filenames, jobs):
+        files = update_entries(self.files, filenames, jobs, scan, self.src,
+                               frozenset(self.includes), directory=self.src)
+        for entry in files.values():
+            # the includes are returned only for the files that have been scanned
+            if len(entry) == 3: continue
+            includes = entry.pop()
+            if includes is not None: self.includes[entry[2]] = includes
+        includes = {entry[2]: self.includes[entry[2]] for entry in files.values()}
+        modified = files != self.files or includes != self.includes
+        self.files = files
+        self.includes = includes
+        return modified
+
+    def edges(self, tree):
+        """Return the mapping of each file to the files of the source directory that it includes
+        ("path" relative to the file first, <path> only relative to the source directory)"""
+        graph = {}
+        for filename, (_, _, digest) in self.files.items():
+            directory = os.path.dirname(filename)
+            targets = []
+            for system, path in self.includes[digest]:
+                candidates = [path]
+                if not system:
+                    candidates.insert(0, os.path.normpath(os.path.join(directory, path)))
+                for candidate in candidates:
+                    candidate = os.path.normcase(candidate).replace('\\', '/')
+                    if candidate.startswith('../'): continue
+                    target = tree.find(candidate)
+                    if target is None: continue
+                    if target not in targets: targets.append(target)
+                    break
+            graph[filename] = targets
+        return graph
+
+def components(graph):
+    """Return strongly connected components of the graph in reverse topological order (the
+    components that a component includes come before it), iterative Tarjan's algorithm"""
+    index = {}
+    low = {}
+    stack = []
+    on_stack = set()
+    result = []
+    for root in graph:
+        if root in index: continue
+        work = [(root, iter(graph.get(root, ())))]
+        index[root] = low[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        while work:
+            node, successors = work[-1]
+            for successor in successors:
+                if successor not in index:
+                    index[successor] = low[successor] = len(index)
+                    stack.append(successor)
+                    on_stack.add(successor)
+                    work.append((successor, iter(graph.get(successor, ()))))
+                    break
+                if successor in on_stack: low[node] = min(low[node], index[successor])
+            else:
+                work.pop()
+                if work: low[work[-1][0]] = min(low[work[-1][0]], low[node])
+                if low[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.remove(member)
+                        component.append(member)
+                        if member == node: break
+                    result.append(component)
+    return result
+
+def cycle(graph, component):
+    """Return the shortest include cycle through the first file of the component"""
+    members = set(component)
+    start = min(component)
+    previous = {}
+    queue = [start]
+    for node in queue:
+        for successor in graph.get(node, ()):
+            if successor not in members or successor in previous: continue
+            previous[successor] = node
+            if successor == start:
+                path = [start]
+                node = previous[start]
+                while node != start:
+                    path.append(node)
+                    node = previous[node]
+                return [start] + path[:0:-1] + [start]
+            queue.append(successor)
+    return [start, start]
+
+def cycles(graph, components):
+    """Return include cycles (files that include themselves directly or indirectly)"""
+    return [cycle(graph, c) for c in components
+            if len(c) > 1 or c[0] in graph.get(c[0], ())]
+
+def fan_in(graph, components, sources):
+    """Return the number of the source files that include each file directly or indirectly
+    (bit sets of the source files are propagated through the components in topological order)"""
+    component_of = {}
+    for i,c in enumerate(components):
+        for member in c: component_of[member] = i
+    bits = {source: 1 << i for i,source in enumerate(sources)}
+    reached = [0]*len(components)
+    for i,c in enumerate(components):
+        for member in c: reached[i] |= bits.get(member, 0)
+    # predecessors come after their successors in the reverse topological order
+    for i in range(len(components) - 1, -1, -1):
+        for member in components[i]:
+            for successor in graph.get(member, ()):
+                j = component_of[successor]
+                if j != i: reached[j] |= reached[i]
+    return {member: bin(reached[i] & ~bits.get(member, 0)).count('1')
+            for i,c in enumerate(components) for member in c}
+
+def load(tree, jobs, persist=True):
+    """Build the include graph of the source directory, refreshing the persisted one if
+    requested"""
+    matches = extension_matcher(EXTENSIONS)
+    filenames = sorted(f for f in tree.files if matches(f))
+    def update(data):
+        try:
+            graph = IncludeGraph(tree.src, data['files'], data['includes'])
+        except (KeyError, TypeError):
+            graph = IncludeGraph(tree.src)
+        if not graph.update(filenames, jobs): return graph, None
+        return graph, {'files': graph.files, 'includes': graph.includes}
+    return load_index('includes', tree.src, persist, update)
+
+def report(graph, tree, filenames, report_cycles=True, min_fan_in=None):
+    """Print include cycles and the headers that at least min_fan_in source files include
+    (only the ones that involve the files if any are given) and return non-zero if anything
+    is printed"""
+    def name(path): return os.path.relpath(os.path.join(graph.src, path))
+    ret = 0
+    edges = graph.edges(tree)
+    order = components(edges)
+    selected = set(os.path.normcase(os.path.relpath(os.path.abspath(f), graph.src))
+                   .replace('\\', '/') for f in filenames)
+    if report_cycles:
+        for c in cycles(edges, order):
+            if selected and selected.isdisjoint(c): continue
+            print('{}: include cycle {}'.format(name(c[0]), ' -> '.join(name(p) for p in c)))
+            ret = 1
+    if min_fan_in is not None:
+        matches = extension_matcher(CPP_SOURCE_EXTENSIONS)
+        counts = fan_in(edges, order, [f for f in edges if matches(f)])
+        for path, n in sorted(counts.items(), key=lambda x: (-x[1], x[0])):
+            if n < min_fan_in: break
+            if selected and path not in selected: continue
+            print('{}: included by {} source files'.format(name(path), n))
+            ret = 1
+    return ret
@@ -1,7 +1,15 @@
 import argparse
-import subprocess
-from enum import IntEnum
 from datetime import datetime
+from functools import lru_cache
+
+from pre_commit_hooks_cpp import executor, timings
+from pre_commit_hooks_cpp import history as git_history
+from pre_commit_hooks_cpp.files import write_result
+from pre_commit_hooks_cpp.git import head
+from pre_commit_hooks_cpp.header_guard import HEADER_EXTENSIONS, CPP_SOURCE_EXTENSIONS
+
+# files that the hook processes
+EXTENSIONS = HEADER_EXTENSIONS | CPP_SOURCE_EXTENSIONS
 
 GPL3_LICENSE_NOTICE = """This file is part of {0}.
 
@@ -45,124 +53,130 @@ OTHER DEALINGS IN THE SOFTWARE.
 
 For more information, please refer to <http://unlicense.org/>"""
 
-class State(IntEnum):
-    Initial = 0,
-    Start = 1,
-    Found = 2,
-
-def copyright_notice(filename, aliases, args):
-    lines = []
-    result = subprocess.run(
-        ['git', '--no-pager', 'log', '--pretty=format:%an|%ad', '--date=format:%Y',
-            '--follow', '--', filename],
-        stdout=subprocess.PIPE)
-    result = result.stdout.decode('utf-8')
-    if result:
-        lines = result.split('\n')
-    if not lines:
-        username = subprocess.run(['git', 'config', 'user.name'], stdout=subprocess.PIPE)
-        username = username.stdout.decode('utf-8').strip()
-        lines = ['|'.join([username, datetime.now().strftime("%Y")])]
+def authors_signature(filename, history, aliases):
+    """Return the authors of the file and their years of modification as a hashable key"""
     authors = {}
-    for line in lines:
-        pair = line.split('|')
-        author = aliases.get(pair[0], pair[0])
-        date = pair[1]
-        dates = authors.get(author, [])
-        dates.append(date)
-        authors[author] = sorted(set(dates))
+    for author,years in history.authors(filename).items():
+        author = aliases.get(author, author)
+        authors.setdefault(author, set()).update(years)
+    return tuple(sorted((author, tuple(sorted(years))) for author,years in authors.items()))
+
+def copyright_lines(authors, copyright_string):
     lines = []
-    for author,dates in authors.items():
-        lines.append(args.copyright_string + ' ' + ', '.join(dates) + ' ' + author)
+    for author,dates in authors:
+        lines.append(copyright_string + ' ' + ', '.join(dates) + ' ' + author)
     return '\n'.join(sorted(lines))
 
-def full_notice(filename, aliases, args):
+def copyright_notice(filename, history, aliases, args):
+    return copyright_lines(authors_signature(filename, history, aliases), args.copyright_string)
+
+@lru_cache(maxsize=1024)
+def render_notice(authors, copyright_string, preamble, license_notice, programme_name,
+                  postamble):
+    """Return the comment with the notices; files mostly share a few sets of authors and years,
+    so the comments are rendered once per set"""
     result = ''
     result += '/*'
-    if args.preamble:
+    if preamble:
         result += '\n'
-        result += args.preamble
+        result += preamble
     result += '\n'
-    result += copyright_notice(filename, aliases, args)
+    result += copyright_lines(authors, copyright_string)
     result += '\n\n'
-    result += args.license_notice.format(args.programme_name)
-    if args.postamble:
+    result += license_notice.format(programme_name)
+    if postamble:
         result += '\n'
-        result += args.postamble
+        result += postamble
     result += '\n'
     result += '*/'
     return result
 
-def add_comment(content, filename, aliases, args):
-    position = 0
-    length = len(content)
-    state = State.Initial
-    start = 0
-    end = 0
-    while position != length:
-        if state == State.Initial:
-            idx = content.find('/*', position)
-            if idx != -1:
-                state = State.Start
-                position = idx
-                start = idx
-            else:
-                position = length
-        elif state == State.Start:
-            idx1 = content.find(args.copyright_string, position)
-            idx2 = content.find('*/', position)
-            if idx1 != -1 and idx2 != -1 and idx1 < idx2:
-                state = State.Found
-                end = idx2 + 2
-                position = length
-            elif idx1 != -1 and idx2 != -1:
-                state = State.Initial
-                position = min(idx1, idx2)
-            elif idx1 != -1 and idx2 == -1:
-                state = State.Initial
-                position = idx1
-            elif idx1 == -1 and idx2 != -1:
-                state = State.Initial
-                position = idx2
-            else:
-                state = State.Initial
-                position = length
-    if state == State.Found:
-        content = content[:start] + full_notice(filename, aliases, args) + content[end:]
-    else:
-        content = full_notice(filename, aliases, args) + '\n\n' + content
-    return content
+def full_notice(filename, history, aliases, args):
+    return render_notice(authors_signature(filename, history, aliases), args.copyright_string,
+                         args.preamble, args.license_notice, args.programme_name, args.postamble)
 
-def main(argv=None):
-    parser = argparse.ArgumentParser(description='Prepend/update copyright and license notices')
-    parser.add_argument('filenames', nargs='*', help='Filenames to check')
+def find_notice(content, copyright_string):
+    """Return the start and the end of the first block comment that contains the copyright
+    string or None if there is no such comment.
+
+    The copyright string is searched only within each comment, so the content is scanned once.
+    """
+    position = 0
+    while True:
+        start = content.find('/*', position)
+        if start == -1: return None
+        end = content.find('*/', start)
+        if end == -1: return None
+        # the copyright string starts before the end of the comment
+        if content.find(copyright_string, start, end + len(copyright_string) - 1) != -1:
+            return start, end + 2
+        position = end
+
+def add_comment(content, filename, history, aliases, args):
+    notice = full_notice(filename, history, aliases, args)
+    found = find_notice(content, args.copyright_string)
+    if found is None: return notice + '\n\n' + content
+    start, end = found
+    # the notice is up to date, the content is returned without copying
+    if end - start == len(notice) and content.startswith(notice, start): return content
+    return content[:start] + notice + content[end:]
+
+def update_notice(filename, content, history, aliases, args):
+    with timings.stage('legal:notice'):
+        new_content = add_comment(content, filename, history, aliases, args)
+    if new_content != content:
+        print('{}: update copyright/license notice'.format(filename))
+    return new_content
+
+def legal(filename, history, aliases, args):
+    content = None
+    with open(filename) as f:
+        content = f.read();
+    new_content = update_notice(filename, content, history, aliases, args)
+    if new_content == content: return 0
+    write_result(filename, content, new_content, args)
+    return 1
+
+def add_arguments(parser):
     parser.add_argument('--copyright-string', help='Copyright string that must be present in the comment', default='Copyright ©')
     parser.add_argument('--programme-name', help='Name of the programme', default='Foobar')
     parser.add_argument('--preamble', help='Comment preamble', default='')
     parser.add_argument('--license-notice', help='License notice text', default='gpl3+')
     parser.add_argument('--postamble', help='Comment postamble', default='')
     parser.add_argument('--alias', action='append', help='Define author alias', default=[])
-    args = parser.parse_args(argv)
+    parser.add_argument('--no-history-cache', action='store_true',
+                        help='Do not cache authors and years of modification in .git directory')
+
+def setup(args):
     if args.license_notice == 'gpl3+': args.license_notice = GPL3_LICENSE_NOTICE
     elif args.license_notice == 'unlicense': args.license_notice = UNLICENSE_NOTICE
     aliases = {}
     for alias in args.alias:
         pair = alias.split(':')
         aliases[pair[0]] = pair[1]
-    ret = 0
-    for filename in args.filenames:
-        content = None
-        with open(filename) as f:
-            content = f.read();
-        new_content = add_comment(content, filename, aliases, args)
-        if new_content != content:
-            content = new_content
-            ret = 1
-        if ret != 0:
-            print('{}: update copyright/license notice'.format(filename))
-            with open(filename, 'w') as f:
-                f.write(content)
-    return ret
+    with timings.stage('legal:history'):
+        history = git_history.load(cache=not args.no_history_cache)
+    return history, aliases
+
+def cache_key(history, aliases):
+    # notices depend on the history and on the current year
+    return [head(history.top), history.username(), datetime.now().strftime("%Y")]
+
+def apply(filename, content, args, history, aliases):
+    return update_notice(filename, content, history, aliases, args)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Prepend/update copyright and license notices')
+    parser.add_argument('filenames', nargs='*', help='Filenames to check')
+    add_arguments(parser)
+    executor.add_arguments(parser)
+    args = parser.parse_args(argv)
+    if not (args.filenames or args.all): return 0
+    timings.start(args)
+    history, aliases = setup(args)
+    cache = executor.open_cache('legal', args, *cache_key(history, aliases))
+    return executor.run(legal, executor.select_files(parser, args, EXTENSIONS), args.jobs,
+                        history, aliases, args, cache=cache)
 
 if __name__ == '__main__':
     exit(main())
@@ -0,0 +1,107 @@
+import re
+
+from pre_commit_hooks_cpp.regex import LazyRegex
+
+# tokens that affect the layout of the code; the lookahead lets the regex engine skip
+# everything else quickly
+TOKEN = LazyRegex(r'''(?=[\n/"'{}()\[\]\dR])(?:
+    (?P<newline>\n)
+  | (?P<comment>//(?:[^\n\\]|\\.)*)
+  | (?P<block>/\*.*?(?:\*/|\Z))
+  | (?P<raw>(?:(?<!\w)|(?<=(?<!\w)u8)|(?<=(?<!\w)[uUL]))
+            R"(?P<delimiter>[^()\\\s"]{0,16})\(.*?(?:\)(?P=delimiter)"|\Z))
+  | (?P<string>"(?:[^"\\\n]|\\.)*"?)
+  | (?P<number>(?<![\w.])\d\w*'(?=\w)(?:[\w.]|'(?=\w)|(?<=[eEpP])[+-])*)
+  | (?P<char>'(?:[^'\\\n]|\\.)*'?)
+  | (?P<open>[{(\[])
+  | (?P<close>[})\]])
+)''', re.X | re.S)
+LABEL = LazyRegex(r'^\s*[a-zA-Z_]+[a-zA-Z_0-9]\s*:\s*$')
+CASE = LazyRegex(r'^\s*case\b')
+
+def _line_level(line, depth, closers, continued, statement):
+    level = depth - closers
+    if continued or statement: level += 1
+    if ':' in line and (LABEL.match(line) or CASE.match(line)): level -= 1
+    return max(level, 0)
+
+def _statement(tail, statement):
+    """Return true if the next line continues an assignment"""
+    if tail.endswith(';'): return False
+    if tail.endswith('=') and not tail.endswith(('==', '!=', '<=', '>=')): return True
+    return statement
+
+def line_layout(text):
+    """Return (level, verbatim, open) for every line of the text in a single pass over tokens.
+
+    Braces, brackets and parentheses increase the level of the following lines, closing
+    tokens at the beginning of the line decrease the level of the line itself. Continuation
+    lines of preprocessor directives and assignments are indented by one more level, labels
+    are indented by one level less. Verbatim is true for the lines that start inside
+    a comment or a literal and open is true for the lines that end inside them.
+    """
+    levels = []
+    depth = 0
+    line_depth = 0
+    closers = 0
+    at_start = True
+    verbatim = False
+    directive = False
+    continued = False
+    statement = False
+    tail = ''
+    start = 0
+    end = 0
+    for m in TOKEN.finditer(text):
+        kind = m.lastgroup
+        position = m.start()
+        if position != end:
+            code = text[end:position].strip()
+            if code:
+                if at_start and code[0] == '#' and not verbatim: directive = True
+                at_start = False
+                tail = code
+        end = m.end()
+        if kind == 'open':
+            if not directive: depth += 1
+            at_start = False
+            tail = '{'
+            continue
+        if kind == 'close':
+            if directive: at_start = False
+            else:
+                depth -= 1
+                if at_start: closers += 1
+            tail = '}'
+            continue
+        if kind == 'newline':
+            line = text[start:position]
+            levels.append((_line_level(line, line_depth, closers, continued, statement),
+                           verbatim, False))
+            if directive: continued = line.endswith('\\')
+            else: continued, statement = False, _statement(tail, statement)
+            line_depth, closers, at_start, directive, verbatim, tail = \
+                depth, 0, True, continued, False, ''
+            start = end
+            continue
+        if kind != 'comment' and kind != 'block':
+            at_start = False
+            tail = '"'
+        first = text.find('\n', position, end)
+        if first == -1: continue
+        # multi-line comment or literal
+        line = text[start:first]
+        levels.append((_line_level(line, line_depth, closers, continued, statement),
+                       verbatim, True))
+        if directive: continued = False
+        else: continued, statement = False, _statement(tail, statement)
+        last = text.rfind('\n', position, end)
+        for _ in range(text.count('\n', first+1, last+1)):
+            levels.append((0, True, True))
+        line_depth, closers, at_start, directive, verbatim, tail = \
+            depth, 0, True, False, True, ''
+        start = last + 1
+    if start != len(text):
+        levels.append((_line_level(text[start:], line_depth, closers, continued, statement),
+                       verbatim, False))
+    return levels
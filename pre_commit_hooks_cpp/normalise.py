@@ -1,5 +1,18 @@
 import argparse
-import chardet
+import codecs
+import os
+import re
+
+from pre_commit_hooks_cpp import diff, executor, timings
+from pre_commit_hooks_cpp.files import AtomicFile, STREAM_THRESHOLD, chunks, decode_chunks, \
+    map_file, verdict_only, write_result
+from pre_commit_hooks_cpp.header_guard import HEADER_EXTENSIONS, CPP_SOURCE_EXTENSIONS
+from pre_commit_hooks_cpp.regex import LazyRegex
+
+# files that the hook processes
+EXTENSIONS = HEADER_EXTENSIONS | CPP_SOURCE_EXTENSIONS
+LINE_HEAD = LazyRegex(r'^(?=[^\n]*\t)[^\S\n]+', re.M)
+LINE_TAIL = LazyRegex(r'(?<![^\S\n])[^\S\n]+$', re.M)
 
 def normalise_line_head(line, n):
     """Replace white-space characters at the beginning of the line with spaces"""
@@ -38,64 +51,285 @@ def normalise_line(line, nspaces):
 def normalise_lines(lines):
     return remove_empty_lines(lines)
 
+def normalise_text_lines(text, nspaces):
+    """Normalise the beginning and the end of every line of the text that ends with a newline"""
+    if '\t' in text:
+        def expand(m):
+            head = m.group()
+            return ' '*(len(head) + head.count('\t')*(nspaces-1))
+        text = LINE_HEAD.sub(expand, text)
+    return LINE_TAIL.sub('', text)
+
+def normalise_text(text, nspaces):
+    """Normalise white space in the whole text at once.
+
+    The result is the same as applying normalise_line to every line and then removing empty
+    lines with remove_empty_lines, but regular expressions and slices are used instead of
+    per-line and per-character loops.
+    """
+    if not text: return text
+    if not text.endswith('\n'): text += '\n'
+    text = normalise_text_lines(text, nspaces)
+    start = len(text) - len(text.lstrip('\n'))
+    if start == len(text):
+        # only empty lines: remove_empty_lines keeps the only line, but removes two or more
+        return text if start == 1 else ''
+    end = len(text.rstrip('\n')) + 1
+    return text[start:end]
+
+def normalise_ranges(text, ranges, nspaces):
+    """Normalise white space only in the line ranges.
+
+    Empty lines are removed from the beginning and the end of the text only if the first
+    and the last line respectively are in the ranges.
+    """
+    if not ranges: return text
+    lines = text.split('\n')
+    last = len(lines) - 1 if text.endswith('\n') else len(lines)
+    for start, end in ranges:
+        for i in range(start-1, min(end, last)):
+            lines[i] = normalise_text_lines(lines[i] + '\n', nspaces)[:-1]
+    if ranges.overlaps(last, last):
+        while lines and not lines[-1]: lines.pop()
+        text = '\n'.join(lines) + '\n' if lines else ''
+    else:
+        text = '\n'.join(lines)
+    if 1 in ranges: text = text.lstrip('\n')
+    return text
+
+class WhiteSpaceStream:
+    """Incremental version of normalise_text for the text that comes in arbitrary chunks.
+
+    Only the incomplete last line and the count of pending empty lines are kept between the
+    chunks. The attribute changed is set when the output differs from the input.
+    """
+
+    def __init__(self, nspaces):
+        self.nspaces = nspaces
+        self.changed = False
+        self.rest = ''
+        self.started = False
+        self.leading = 0
+        self.pending = 0
+
+    def feed(self, text):
+        text = self.rest + text
+        end = text.rfind('\n') + 1
+        self.rest = text[end:]
+        return self._lines(text[:end])
+
+    def close(self):
+        result = ''
+        if self.rest:
+            result = self._lines(self.rest + '\n')
+            self.rest = ''
+            self.changed = True
+        if not self.started:
+            if self.leading > 1: self.changed = True
+            return '\n' if self.leading == 1 else ''
+        if self.pending: self.changed = True
+        return result
+
+    def _lines(self, text):
+        if not text: return ''
+        new_text = normalise_text_lines(text, self.nspaces)
+        if new_text != text: self.changed = True
+        if not self.started:
+            body = new_text.lstrip('\n')
+            self.leading += len(new_text) - len(body)
+            if not body: return ''
+            if self.leading: self.changed = True
+            self.started = True
+            new_text = body
+        body = new_text.rstrip('\n')
+        if not body:
+            self.pending += len(new_text)
+            return ''
+        result = '\n'*self.pending + body + '\n'
+        self.pending = len(new_text) - len(body) - 1
+        return result
+
+def translate_newlines(text):
+    """Replace line endings with newline characters the same way as text-mode files do"""
+    return text.replace('\r\n', '\n').replace('\r', '\n')
+
 def remove_bom(content):
-    if content[0:3] == b'\xef\xbb\xbf': content = content[:4]
+    if content[0:3] == b'\xef\xbb\xbf': content = content[3:]
     return content
 
-def normalise_encoding(filename):
-    ret = 0
-    content = None
-    with open(filename, 'rb') as f: content = f.read()
+def detect_encoding(content, args, offset=0):
+    """Return the encoding of the content and the name of the detector that has chosen it.
+
+    ASCII and UTF-8 are checked first, and chardet is used only if both checks fail.
+    chardet looks at the first --chardet-sample bytes and its result is discarded
+    if the confidence is lower than --chardet-confidence.
+    """
+    if all(c.isascii() for c in chunks(content, offset)): return 'ascii', 'ascii', 1.0
+    try:
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        for c in chunks(content, offset): decoder.decode(c)
+        decoder.decode(b'', final=True)
+        return 'utf-8', 'utf-8', 1.0
+    except UnicodeDecodeError:
+        pass
+    import chardet
+    with timings.stage('normalise:chardet'):
+        detector = chardet.UniversalDetector()
+        end = offset + args.chardet_sample
+        for c in chunks(content, offset, 65536):
+            detector.feed(c[:end-offset])
+            offset += len(c)
+            if detector.done or offset >= end: break
+        result = detector.close()
+    encoding = result['encoding']
+    confidence = result['confidence']
+    if confidence < args.chardet_confidence: encoding = None
+    return encoding, 'chardet', confidence
+
+def normalise_encoding(filename, content, args):
+    """Remove byte order mark and convert the content to UTF-8"""
     c = remove_bom(content)
     if c != content:
         content = c
-        ret = 1
         print('{}: remove BOM'.format(filename))
-    encoding = chardet.detect(content)['encoding']
+    encoding, detector, confidence = detect_encoding(content, args)
+    if args.verbose:
+        print('{}: {} encoding detected by {} with confidence {:.2f}'.format(
+            filename, encoding, detector, confidence))
     if encoding != 'ascii' and encoding != 'utf-8' and encoding is not None:
         content = bytes(str(content, encoding), 'utf-8')
-        ret = 1
         print('{}: convert from {} to utf-8'.format(filename, encoding))
-    if ret != 0:
-        with open(filename, 'wb') as f: f.write(content);
-    return ret
-
-def normalise_white_space(filename, args):
-    ret = 0
-    lines = None
-    with open(filename) as f:
-        lines = f.readlines();
-    for i,line in enumerate(lines):
-        l = normalise_line(line, args.tab_width)
-        if l != line:
-            lines[i] = l
-            ret = 1
-    l = normalise_lines(lines)
-    if len(l) != len(lines):
-        lines = l
-        ret = 1
-    if ret != 0:
+    return content
+
+def normalise_white_space(filename, content, args, ranges=None):
+    """Normalise white space in UTF-8 content and return the original content if nothing changed"""
+    text = translate_newlines(content.decode('utf-8', 'surrogateescape'))
+    if ranges is None: new_text = normalise_text(text, args.tab_width)
+    else: new_text = normalise_ranges(text, ranges, args.tab_width)
+    if new_text != text:
         print('{}: remove white space'.format(filename))
-        with open(filename, 'w') as f:
-            for line in lines:
-                f.write(line)
-    return ret
+        content = new_text.encode('utf-8', 'surrogateescape')
+    return content
+
+def normalise_content(filename, content, args, changed=None):
+    with timings.stage('normalise:encoding'):
+        new_content = normalise_encoding(filename, content, args)
+    if verdict_only(args) and new_content != content: return new_content
+    content = new_content
+    with timings.stage('normalise:white-space'):
+        return normalise_white_space(filename, content, args, diff.file_ranges(changed, filename))
+
+def stream_encoding(filename, content, args):
+    """Report BOM and encoding of memory-mapped file and return the offset of the text, its
+    encoding and decoding errors"""
+    offset = 0
+    if content[0:3] == b'\xef\xbb\xbf':
+        offset = 3
+        print('{}: remove BOM'.format(filename))
+    encoding, detector, confidence = detect_encoding(content, args, offset)
+    if args.verbose:
+        print('{}: {} encoding detected by {} with confidence {:.2f}'.format(
+            filename, encoding, detector, confidence))
+    if encoding != 'ascii' and encoding != 'utf-8' and encoding is not None:
+        print('{}: convert from {} to utf-8'.format(filename, encoding))
+        return offset, encoding, 'strict'
+    return offset, 'utf-8', 'surrogateescape'
+
+def white_space_changed(content, args):
+    """Return true if white space in memory-mapped UTF-8 file needs normalising (stops at the
+    first change)"""
+    stream = WhiteSpaceStream(args.tab_width)
+    for text in decode_chunks(content, 'utf-8', 'surrogateescape'):
+        stream.feed(text)
+        if stream.changed: return True
+    stream.close()
+    return stream.changed
+
+def normalise_stream(filename, args):
+    """Normalise memory-mapped file chunk by chunk using constant amount of memory.
+
+    Clean files are only read, the others are written to a temporary file that replaces the
+    file after it has been unmapped.
+    """
+    with map_file(filename) as content:
+        offset, encoding, errors = stream_encoding(filename, content, args)
+        if offset == 0 and errors != 'strict' and not white_space_changed(content, args):
+            return 0
+    with AtomicFile(filename) as output:
+        with map_file(filename) as content:
+            stream = WhiteSpaceStream(args.tab_width)
+            for text in decode_chunks(content, encoding, errors, offset):
+                output.file.write(stream.feed(text).encode('utf-8', 'surrogateescape'))
+            output.file.write(stream.close().encode('utf-8', 'surrogateescape'))
+        if stream.changed:
+            print('{}: remove white space'.format(filename))
+        output.commit()
+    return 1
+
+def check_stream(filename, args):
+    """Check memory-mapped file chunk by chunk and stop at the first change"""
+    with map_file(filename) as content:
+        offset, encoding, errors = stream_encoding(filename, content, args)
+        if offset or errors == 'strict': return 1
+        if not white_space_changed(content, args): return 0
+    print('{}: remove white space'.format(filename))
+    return 1
+
+def normalise(filename, args, changed=None):
+    """Read the file once, pass its content through all stages and write it at most once"""
+    if changed is None and os.path.getsize(filename) >= args.stream_threshold:
+        with timings.stage('normalise:stream'):
+            if verdict_only(args): return check_stream(filename, args)
+            if not args.diff: return normalise_stream(filename, args)
+    content = None
+    with timings.stage('read'), open(filename, 'rb') as f: content = f.read()
+    new_content = normalise_content(filename, content, args, changed)
+    if new_content == content: return 0
+    write_result(filename, content, new_content, args)
+    return 1
 
 def int_positive(text):
     i = int(text)
     if i <= 0: raise argparse.ArgumentTypeError("%s must be positive" % text)
     return i
 
+def probability(text):
+    p = float(text)
+    if p < 0 or p > 1: raise argparse.ArgumentTypeError("%s must be in [0,1]" % text)
+    return p
+
+def add_arguments(parser):
+    parser.add_argument('--tab-width', help='Tab width', default=4, type=int_positive)
+    parser.add_argument('--chardet-sample', help='Max. no. of bytes that chardet reads',
+                        default=1024*1024, type=int_positive)
+    parser.add_argument('--chardet-confidence', help='Min. confidence of chardet detection',
+                        default=0.0, type=probability)
+    parser.add_argument('--verbose', action='store_true', help='Report detected encodings')
+    parser.add_argument('--stream-threshold', help='Min. file size in bytes for chunked processing',
+                        default=STREAM_THRESHOLD, type=int_positive)
+    diff.add_arguments(parser)
+
+def setup(args):
+    return (diff.setup(args),)
+
+def cache_key(changed):
+    return [changed]
+
+def apply(filename, content, args, changed):
+    """Normalise bytes (unlike other hooks that normalise text)"""
+    return normalise_content(filename, content, args, changed)
+
 def main(argv=None):
     parser = argparse.ArgumentParser(description='Normalise C/C++ source code')
     parser.add_argument('filenames', nargs='*', help='Filenames to check')
-    parser.add_argument('--tab-width', help='Tab width', default=4, type=int_positive)
+    add_arguments(parser)
+    executor.add_arguments(parser)
     args = parser.parse_args(argv)
-    ret = 0
-    for filename in args.filenames:
-        ret |= normalise_encoding(filename)
-        ret |= normalise_white_space(filename, args)
-    return ret
+    if not (args.filenames or args.all): return 0
+    timings.start(args)
+    state = setup(args)
+    return executor.run(normalise, executor.select_files(parser, args, EXTENSIONS), args.jobs, args, *state,
+                        cache=executor.open_cache('normalise', args, *cache_key(*state)))
 
 if __name__ == '__main__':
     exit(main())
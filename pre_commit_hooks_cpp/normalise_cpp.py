@@ -1,17 +1,18 @@
 import argparse
-import re
+import io
 import os
-from enum import IntEnum
 
-INCLUDE_RELATIVE = re.compile(r'\s*#include\s+"([^"]+)"\s*\n')
-INCLUDE_SYSTEM = re.compile(r'\s*#include\s+<([^>]+)>\s*\n')
-STRAY_BRACE = re.compile(r'^\s*[\)\}\]>]+\s*;*\s*\n')
-LABEL = re.compile(r'^\s*[a-zA-Z_]+[a-zA-Z_0-9]\s*:\s*$')
-CASE = re.compile(r'^\s*case\b')
-EQEND = re.compile(r'.*[^!<>=]=$')
-ELSE = re.compile(r'\}\s*\b(else|catch)\b\s*.*\{')
+from pre_commit_hooks_cpp import diff, executor, timings
+from pre_commit_hooks_cpp import includes, source_tree
+from pre_commit_hooks_cpp.files import verdict_only, write_result
+from pre_commit_hooks_cpp.header_guard import HEADER_EXTENSIONS, CPP_SOURCE_EXTENSIONS
+from pre_commit_hooks_cpp.includes import INCLUDE_RELATIVE
+from pre_commit_hooks_cpp.lexer import line_layout
 
-def relativise_include_path(source_filename, line, src, line_no):
+# files that the hook processes
+EXTENSIONS = HEADER_EXTENSIONS | CPP_SOURCE_EXTENSIONS
+
+def relativise_include_path(source_filename, line, src, line_no, tree=None):
     from os.path import isfile, join
     dir = os.path.dirname(source_filename)
     m = INCLUDE_RELATIVE.match(line)
@@ -22,184 +23,138 @@ def relativise_include_path(source_filename, line, src, line_no):
         if prefix == src:
             filename = os.path.relpath(filename, src)
             filename = os.path.normcase(filename).replace('\\','/')
-            filename_win = filename.lower()
-            # fix windows paths
-            if filename_win != filename and \
-               not isfile(join(src,filename)) and \
-               isfile(join(src,filename_win)):
-                filename = filename_win
-            if isfile(join(src,filename)):
+            if tree is not None and not filename.startswith('../'):
+                filename = tree.find(filename)
+            else:
+                filename_win = filename.lower()
+                timings.count('stat')
+                # fix windows paths
+                if filename_win != filename and \
+                   not isfile(join(src,filename)) and \
+                   isfile(join(src,filename_win)):
+                    filename = filename_win
+                timings.count('stat')
+                if not isfile(join(src,filename)): filename = None
+            if filename is not None:
                 line = '#include <{}>\n'.format(filename)
                 print('{}:{}:1 fix include path'.format(source_filename, line_no))
     return line
 
-def sort_include_paths(lines, top_headers):
-    # expand header names
-    for i,name in enumerate(top_headers):
-        top_headers[i] = '#include <{}>\n'.format(name)
-    result = []
-    block = []
-    for i,line in enumerate(lines):
-        m = INCLUDE_SYSTEM.match(line)
-        if m:
-            line = line.lstrip()
-            block.append(line)
-        else:
-            if len(block) > 0:
-                offset = 0
-                for include in top_headers:
-                    try:
-                        idx = block.index(include)
-                        block[idx], block[offset] = block[offset], block[idx]
-                        offset += 1
-                    except:
-                        pass
-                block[offset:] = sorted(set(block[offset:]))
-                result.extend(block)
-                block = []
-            result.append(line)
-    return result
+def sort_include_paths(lines, top_headers, ranges=None):
+    """Return the lines with the blocks of system includes sorted and the top headers first"""
+    return includes.sort_blocks(list(lines), includes.parse(lines),
+                                includes.top_order(tuple(top_headers)), ranges)
 
-def normalise_include_statements(filename, args):
-    ret = 0
+def normalise_include_lines(filename, lines, args, tree=None, ranges=None):
+    """Return the lines with include paths expanded and sorted"""
+    lines = list(lines)
+    records = includes.parse(lines)
+    for k,include in enumerate(records):
+        i = include.index
+        if include.system or (ranges is not None and i+1 not in ranges): continue
+        l = relativise_include_path(filename, lines[i], args.src, i, tree)
+        if l != lines[i]:
+            lines[i] = l
+            records[k] = includes.parse_line(l, i)
+    return includes.sort_blocks(lines, records, includes.top_order(tuple(args.top)), ranges)
+
+def normalise_include_statements(filename, args, tree=None, changed=None):
     lines = None
     with open(filename) as f:
         lines = f.readlines();
-    for i,line in enumerate(lines):
-        l = relativise_include_path(filename, line, args.src, i)
-        if l != line:
-            lines[i] = l
-            ret = 1
-    new_lines = sort_include_paths(lines, args.top)
-    if new_lines != lines:
-        lines = new_lines
-        ret = 1
-    if ret != 0:
-        with open(filename, 'w') as f:
-            for line in lines:
-                f.write(line)
-    return ret
+    new_lines = normalise_source_lines(filename, lines, args, tree,
+                                       diff.file_ranges(changed, filename))
+    if new_lines == lines: return 0
+    write_result(filename, ''.join(lines), ''.join(new_lines), args)
+    return 1
+
+def indent_lines(lines, width, ranges=None):
+    """Re-indent the lines using the levels computed by the lexer"""
+    result = []
+    for i, (line, (level, verbatim, open)) in enumerate(zip(lines, line_layout(''.join(lines)))):
+        if verbatim or (ranges is not None and i+1 not in ranges):
+            result.append(line)
+            continue
+        if open:
+            result.append(' '*level*width + line.lstrip())
+            continue
+        line = line.strip()
+        result.append(' '*level*width + line + '\n' if line else '\n')
+    return result
 
-class Token(IntEnum):
-    Brace = 0,   # {}
-    Bracket = 1, # []
-    Paren = 2,   # ()
-    Angle = 3,   # <>
+def normalise_source_lines(filename, lines, args, tree=None, ranges=None):
+    """Return the lines with include paths expanded and sorted and re-indented if requested"""
+    with timings.stage('normalise-cpp:includes'):
+        new_lines = normalise_include_lines(filename, lines, args, tree, ranges)
+    if verdict_only(args) and new_lines != lines: return new_lines
+    lines = new_lines
+    if args.indent:
+        with timings.stage('normalise-cpp:indent'):
+            lines = indent_lines(lines, args.tab_width, ranges)
+    return lines
 
 def normalise_indent(filename, args):
-    def no_comments(line):
-        new_line = ''
-        multiline = False
-        c0 = ' '
-        for c in line:
-            if c0 == '/' and c == '/':
-                new_line = new_line[:-1]
-                break
-            if c0 == '/' and c == '*':
-                new_line = new_line[:-1]
-                multiline = True
-            if c0 == '*' and c == '/': multiline = False
-            if not multiline: new_line += c
-            c0 = c
-        return new_line
-    ret = 0
     lines = None
     with open(filename) as f:
         lines = f.readlines();
-    level = 0
-    new_lines = []
-    tokens = [0]*len(Token)
-    multiline_comment = False
-    inside_string = False
-    inside_char = False
-    inside_macro = False
-    inside_statement = False
-    for i,line in enumerate(lines):
-        inside_label = False
-        new_level = level
-        min_level = 100
-        xline = line.strip()
-        yline = no_comments(xline)
-        if xline.startswith('#'):
-            inside_macro = True
-        if not inside_macro:
-            if yline.endswith(';'):
-                inside_statement = False
-            if EQEND.match(yline):
-                inside_statement = True
-        if inside_macro and not xline.endswith('\\'):
-            inside_macro = False
-        if LABEL.match(yline) or CASE.match(yline):
-            inside_label = True
-        if not xline.startswith('//'):
-            c0 = ' '
-            c1 = ' '
-            multiline_comment_line = multiline_comment
-            for c in line:
-                if inside_string:
-                    if (c0 != '\\' or c1 == '\\') and c == '"': inside_string = False;
-                elif inside_char:
-                    if (c0 != '\\' or c1 == '\\') and c == '\'': inside_char = False;
-                elif multiline_comment:
-                    if c0 == '*' and c == '/':
-                        multiline_comment = False
-                        multiline_comment_line = False
-                else:
-                    if c == '{': tokens[Token.Brace] += 1
-                    elif c == '}': tokens[Token.Brace] -= 1
-                    elif c == '[': tokens[Token.Bracket] += 1
-                    elif c == ']': tokens[Token.Bracket] -= 1
-                    elif c == '(': tokens[Token.Paren] += 1
-                    elif c == ')': tokens[Token.Paren] -= 1
-                    elif c == '<': tokens[Token.Angle] += 1
-                    elif c == '>' and (c0 != '-' or c1 == '-'): tokens[Token.Angle] -= 1
-                    elif c0 == '/' and c == '*': multiline_comment = True
-                    elif c == '"': inside_string = True
-                    elif c == '\'': inside_char = True
-                c1 = c0
-                c0 = c
-                new_level = sum(tokens)
-                if inside_macro: new_level += 1
-                if inside_statement: new_level += 1
-                min_level = min(new_level,min_level)
-        #if min_level < level and new_level >= level: level = min_level
-        if ELSE.match(yline): level = min_level
-        if new_level < level and STRAY_BRACE.match(line): level = new_level
-        if inside_label: level = max(level-1,0)
-        #if new_level < level: level = new_level
-        if multiline_comment_line:
-            new_lines.append(line)
-        else:
-            if line != '\n': line = line.lstrip()
-            line = (' '*level*args.tab_width) + line
-            new_lines.append(line.rstrip() + '\n')
-        level = new_level
-    if new_lines != lines:
-        lines = new_lines
-        ret = 1
-    if ret != 0:
-        with open(filename, 'w') as f:
-            for line in lines:
-                f.write(line)
-    return ret
+    new_lines = indent_lines(lines, args.tab_width)
+    if new_lines == lines: return 0
+    write_result(filename, ''.join(lines), ''.join(new_lines), args)
+    return 1
 
 def int_positive(text):
     i = int(text)
     if i <= 0: raise argparse.ArgumentTypeError("%s must be positive" % text)
     return i
 
-def main(argv=None):
-    parser = argparse.ArgumentParser(description='Normalise C/C++ source code')
-    parser.add_argument('filenames', nargs='*', help='Filenames to check')
+def add_arguments(parser):
     parser.add_argument('--src', help='Source directory relative to which include filenames are expanded', default='src')
     parser.add_argument('--top', nargs='+', help='Headers that must be at the top of the list', default=['sys/types.h'])
     parser.add_argument('--tab-width', help='Tab width', default=4, type=int_positive)
-    args = parser.parse_args(argv)
+    parser.add_argument('--indent', action='store_true',
+                        help='Re-indent the code using brace, bracket and parenthesis depth')
+    diff.add_arguments(parser)
+
+def setup(args):
     args.src = os.path.abspath(args.src)
-    ret = 0
-    for filename in args.filenames:
-        ret |= normalise_include_statements(filename, args)
-        #ret |= normalise_indent(filename, args)
+    with timings.stage('normalise-cpp:source-tree'):
+        tree = source_tree.load(args.src, persist=not args.no_cache)
+    return tree, diff.setup(args)
+
+def cache_key(tree, changed):
+    # include paths depend on the files in the source directory
+    return [tree.digest(), changed]
+
+def apply(filename, content, args, tree, changed):
+    lines = io.StringIO(content, newline='\n').readlines()
+    return ''.join(normalise_source_lines(filename, lines, args, tree,
+                                          diff.file_ranges(changed, filename)))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Normalise C/C++ source code')
+    parser.add_argument('filenames', nargs='*', help='Filenames to check')
+    add_arguments(parser)
+    parser.add_argument('--include-cycles', action='store_true',
+                        help='Report include cycles that involve the files (all cycles in the '
+                        'source directory if no files are given)')
+    parser.add_argument('--include-fan-in', metavar='N', type=int_positive,
+                        help='Report headers that N or more source files include directly or '
+                        'indirectly')
+    executor.add_arguments(parser)
+    args = parser.parse_args(argv)
+    reports = args.include_cycles or args.include_fan_in is not None
+    if not (args.filenames or args.all or reports): return 0
+    timings.start(args)
+    state = setup(args)
+    cache = executor.open_cache('normalise-cpp', args, *cache_key(*state))
+    ret = executor.run(normalise_include_statements,
+                       executor.select_files(parser, args, EXTENSIONS), args.jobs, args, *state,
+                       cache=cache)
+    if reports:
+        tree = state[0]
+        graph = includes.load(tree, args.jobs, persist=not args.no_cache)
+        ret |= includes.report(graph, tree, args.filenames, args.include_cycles,
+                               args.include_fan_in)
     return ret
 
 if __name__ == '__main__':
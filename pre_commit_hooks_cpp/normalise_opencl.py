@@ -1,27 +1,107 @@
 import argparse
-import re
+import locale
+import os
 
-KEYWORD = r'\b__(global|local|constant|private|generic|kernel|read_only|write_only|read_write)\b'
+from pre_commit_hooks_cpp import executor, timings
+from pre_commit_hooks_cpp.regex import LazyRegex
+from pre_commit_hooks_cpp.files import AtomicFile, STREAM_THRESHOLD, decode_chunks, map_file, \
+    verdict_only, write_result
+
+# files that the hook processes
+EXTENSIONS = {'.cl'}
+KEYWORD = LazyRegex(r'\b__(global|local|constant|private|generic|kernel|read_only|write_only|read_write)\b')
+
+# the word at the end of a chunk that may continue in the next one
+TAIL = LazyRegex(r'\w*\Z')
+# the longest keyword and the word character before it
+MAX_TAIL = len('__read_write') + 1
+
+def split_tail(text):
+    """Split the text before the word at its end that may be the beginning of a keyword
+    (MAX_TAIL characters at most, so that a long word is not carried over chunk by chunk)"""
+    end = TAIL.search(text, max(len(text) - MAX_TAIL, 0)).start()
+    return text[:end], text[end:]
+
+def remove_keywords(head):
+    """Remove the keywords from the text that the next chunk continues (a keyword that ends
+    at the end of the text may be the beginning of a longer word)"""
+    return KEYWORD.sub(lambda m: m.group(0) if m.end() == len(head) else m.group(1), head)
+
+def keywords_found(content, encoding):
+    """Search memory-mapped file chunk by chunk and stop at the first keyword"""
+    rest = ''
+    for text in decode_chunks(content, encoding):
+        head, rest = split_tail(rest + text)
+        if any(m.end() != len(head) for m in KEYWORD.finditer(head)): return True
+    return KEYWORD.search(rest) is not None
+
+def check_keywords_stream(filename):
+    with map_file(filename) as content:
+        if not keywords_found(content, locale.getpreferredencoding(False)): return 0
+    print('{}: normalise OpenCL keywords'.format(filename))
+    return 1
+
+def normalise_keywords_stream(filename):
+    """Remove the underscores from OpenCL keywords in memory-mapped file chunk by chunk,
+    writing only the files that contain them"""
+    encoding = locale.getpreferredencoding(False)
+    with map_file(filename) as content:
+        if not keywords_found(content, encoding): return 0
+    with AtomicFile(filename) as output:
+        with map_file(filename) as content:
+            rest = ''
+            for text in decode_chunks(content, encoding):
+                head, rest = split_tail(rest + text)
+                output.file.write(remove_keywords(head).encode(encoding))
+            output.file.write(KEYWORD.sub(r'\1', rest).encode(encoding))
+        output.commit()
+    print('{}: normalise OpenCL keywords'.format(filename))
+    return 1
+
+def normalise_keywords_text(filename, content):
+    with timings.stage('normalise-opencl:keywords'):
+        new_content = KEYWORD.sub(r'\1', content)
+    if new_content != content:
+        print('{}: normalise OpenCL keywords'.format(filename))
+    return new_content
+
+def normalise_keywords(filename, args):
+    if os.path.getsize(filename) >= args.stream_threshold:
+        with timings.stage('normalise-opencl:stream'):
+            if verdict_only(args): return check_keywords_stream(filename)
+            if not args.diff: return normalise_keywords_stream(filename)
+    content = None
+    with open(filename) as f:
+        content = f.read();
+    if verdict_only(args):
+        if KEYWORD.search(content) is None: return 0
+        print('{}: normalise OpenCL keywords'.format(filename))
+        return 1
+    new_content = normalise_keywords_text(filename, content)
+    if new_content == content: return 0
+    write_result(filename, content, new_content, args)
+    return 1
+
+def add_arguments(parser):
+    parser.add_argument('--stream-threshold', help='Min. file size in bytes for chunked processing',
+                        default=STREAM_THRESHOLD, type=executor.int_positive)
+
+def setup(args):
+    return ()
+
+def apply(filename, content, args):
+    return normalise_keywords_text(filename, content)
 
 def main(argv=None):
     parser = argparse.ArgumentParser(description='Normalise OpenCL keywords')
     parser.add_argument('filenames', nargs='*', help='Filenames to check')
+    add_arguments(parser)
+    executor.add_arguments(parser)
     args = parser.parse_args(argv)
-    ret = 0
-    for filename in args.filenames:
-        content = None
-        with open(filename) as f:
-            content = f.read();
-        new_content = re.sub(KEYWORD, r'\1', content)
-        if new_content != content:
-            content = new_content
-            ret = 1
-        if ret != 0:
-            print('{}: normalise OpenCL keywords'.format(filename))
-            with open(filename, 'w') as f:
-                f.write(content)
-    return ret
+    timings.start(args)
+    return executor.run(normalise_keywords, executor.select_files(parser, args, EXTENSIONS),
+                        args.jobs, args,
+                        cache=executor.open_cache('normalise-opencl', args))
 
 if __name__ == '__main__':
     exit(main())
-
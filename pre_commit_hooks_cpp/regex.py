@@ -0,0 +1,17 @@
+import re
+
+class LazyRegex:
+    """Regular expression that is compiled on first use.
+
+    The attributes of the compiled expression are copied to the instance when they are first
+    accessed, so that the subsequent calls do not go through __getattr__.
+    """
+
+    def __init__(self, pattern, flags=0):
+        self.pattern = pattern
+        self.flags = flags
+
+    def __getattr__(self, name):
+        value = getattr(re.compile(self.pattern, self.flags), name)
+        setattr(self, name, value)
+        return value
@@ -0,0 +1,79 @@
+import hashlib
+import os
+
+from pre_commit_hooks_cpp import timings
+from pre_commit_hooks_cpp.cache import load_index
+
+class SourceTree:
+    """In-memory index of the files in the source directory"""
+
+    def __init__(self, src):
+        self.src = src
+        self.files = set()
+        self.directories = {}
+
+    def find(self, filename):
+        """Return the path relative to the source directory or None if the file does not exist"""
+        if filename in self.files: return filename
+        # fix windows paths
+        filename_win = filename.lower()
+        if filename_win != filename and filename_win in self.files: return filename_win
+        return None
+
+    def digest(self):
+        h = hashlib.blake2b(digest_size=20)
+        for filename in sorted(self.files):
+            h.update(filename.encode('utf-8', 'surrogateescape') + b'\0')
+        return h.hexdigest()
+
+    def scan(self, cached=None):
+        """List the source directory reusing the listings of unchanged directories"""
+        cached = cached or {}
+        stack = [('', frozenset())]
+        while stack:
+            relative, ancestors = stack.pop()
+            directory = os.path.join(self.src, relative)
+            timings.count('stat')
+            try:
+                s = os.stat(directory)
+            except OSError:
+                continue
+            # symbolic links to directories are indexed under each path, except the ones
+            # that point to a parent directory
+            if (s.st_dev, s.st_ino) in ancestors: continue
+            ancestors = ancestors | {(s.st_dev, s.st_ino)}
+            entry = cached.get(relative)
+            if entry is None or entry[0] != s.st_mtime_ns:
+                entry = [s.st_mtime_ns] + list_directory(directory)
+            self.directories[relative] = entry
+            _, files, subdirectories = entry
+            prefix = relative + '/' if relative else ''
+            for name in files:
+                self.files.add(os.path.normcase(prefix + name).replace('\\', '/'))
+            for name in subdirectories:
+                stack.append((prefix + name, ancestors))
+        return self
+
+def list_directory(directory):
+    """Return the names of the files and of the subdirectories (symbolic links are followed)"""
+    files = []
+    subdirectories = []
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(): subdirectories.append(entry.name)
+                    elif entry.is_file(): files.append(entry.name)
+                except OSError:
+                    pass
+    except OSError:
+        pass
+    return [files, subdirectories]
+
+def load(src, persist=True):
+    """Build the index of the source directory, refreshing the persisted one if requested"""
+    def update(cached):
+        if not isinstance(cached, dict): cached = {}
+        tree = SourceTree(src).scan(cached)
+        return tree, tree.directories if tree.directories != cached else None
+    return load_index('src', src, persist, update)
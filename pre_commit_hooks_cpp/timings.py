@@ -0,0 +1,160 @@
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager, nullcontext
+
+_NULL = nullcontext()
+_records = None
+_current = None
+_profile = None
+_args = None
+_started = None
+
+class Record:
+    """Wall time, bytes, stage times and counters of one file"""
+
+    def __init__(self, name, size=0):
+        self.name = name
+        self.seconds = 0.0
+        self.bytes = size
+        self.stages = {}
+        self.counts = {}
+
+    def add(self, other):
+        self.seconds += other['seconds']
+        self.bytes += other['bytes']
+        for name, seconds in other['stages'].items():
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+        for name, n in other['counts'].items():
+            self.counts[name] = self.counts.get(name, 0) + n
+
+    def as_dict(self):
+        return {'file': self.name, 'seconds': self.seconds, 'bytes': self.bytes,
+                'stages': self.stages, 'counts': self.counts}
+
+def enabled():
+    return _records is not None
+
+def enable():
+    global _records, _current, _started
+    _records = []
+    _current = Record(None)
+    _started = time.perf_counter()
+
+def add_arguments(parser):
+    parser.add_argument('--timings', action='store_true',
+                        help='Print time spent in each stage and the slowest files')
+    parser.add_argument('--timings-top', help='No. of the slowest files to print',
+                        default=10, type=int)
+    parser.add_argument('--trace', help='Write times of each file and stage to this JSON file')
+    parser.add_argument('--profile', help='Write cProfile statistics to this file '
+                        '(files are processed serially)')
+
+def start(args):
+    """Enable instrumentation if requested and report the results at exit"""
+    global _profile, _args
+    if not (args.timings or args.trace or args.profile): return
+    _args = args
+    enable()
+    if args.profile:
+        import cProfile
+        args.jobs = 1
+        _profile = cProfile.Profile()
+        _profile.enable()
+    import atexit
+    atexit.register(report)
+
+@contextmanager
+def _file(filename):
+    global _current
+    # (mode, object name, path) entries of --from-index
+    if isinstance(filename, tuple): filename = filename[-1]
+    try:
+        size = os.path.getsize(filename)
+    except (OSError, TypeError, ValueError):
+        size = 0
+    parent = _current
+    _current = Record(filename, size)
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        _current.seconds = time.perf_counter() - t0
+        _records.append(_current.as_dict())
+        _current = parent
+
+def file(filename):
+    """Record the time spent processing the file"""
+    return _file(filename) if _records is not None else _NULL
+
+@contextmanager
+def _stage(name):
+    record = _current
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        record.stages[name] = record.stages.get(name, 0.0) + time.perf_counter() - t0
+
+def stage(name):
+    """Record the time spent in the stage of processing the current file"""
+    return _stage(name) if _records is not None else _NULL
+
+def count(name, n=1):
+    if _records is not None: _current.counts[name] = _current.counts.get(name, 0) + n
+
+@contextmanager
+def _subprocess():
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        count('subprocesses')
+        _current.stages['subprocess'] = (_current.stages.get('subprocess', 0.0) +
+                                         time.perf_counter() - t0)
+
+def subprocess():
+    """Count the subprocess and record the time until it exits"""
+    return _subprocess() if _records is not None else _NULL
+
+def pop():
+    """Return the records of the files processed by this worker process"""
+    global _records
+    if _records is None: return None
+    records = _records
+    _records = []
+    return records
+
+def extend(records):
+    """Add records returned by a worker process"""
+    if records: _records.extend(records)
+
+def report():
+    if _profile is not None:
+        _profile.disable()
+        _profile.dump_stats(_args.profile)
+    setup = _current.as_dict()
+    setup['seconds'] = time.perf_counter() - _started
+    total = Record(None)
+    for record in _records: total.add(record)
+    total.stages.update((k, total.stages.get(k, 0.0) + v) for k, v in setup['stages'].items())
+    total.counts.update((k, total.counts.get(k, 0) + v) for k, v in setup['counts'].items())
+    if _args.trace:
+        with open(_args.trace, 'w') as f:
+            json.dump({'wall': setup, 'total': total.as_dict(), 'files': _records}, f, indent=2)
+    if not _args.timings: return
+    out = sys.stderr
+    print('{:<40} {:>10}'.format('stage', 'seconds'), file=out)
+    for name, seconds in sorted(total.stages.items(), key=lambda x: -x[1]):
+        print('{:<40} {:>10.3f}'.format(name, seconds), file=out)
+    for name, n in sorted(total.counts.items()):
+        print('{:<40} {:>10}'.format(name, n), file=out)
+    print('{:<40} {:>10.3f}'.format('wall time', setup['seconds']), file=out)
+    print('{:<40} {:>10} {:>12} {:>6} {:>6}'.format('slowest files', 'seconds', 'bytes',
+                                                    'subpr.', 'stat'), file=out)
+    slowest = sorted(_records, key=lambda r: -r['seconds'])[:_args.timings_top]
+    for r in slowest:
+        print('{:<40} {:>10.3f} {:>12} {:>6} {:>6}'.format(
+            r['file'], r['seconds'], r['bytes'], r['counts'].get('subprocesses', 0),
+            r['counts'].get('stat', 0)), file=out)
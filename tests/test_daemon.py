@@ -0,0 +1,30 @@
+import os
+import subprocess
+
+from pre_commit_hooks_cpp.daemon import Sessions
+
+def git(cwd, *args):
+    subprocess.run(['git', '-C', str(cwd)] + list(args), check=True, capture_output=True)
+
+def test_requests_reuse_set_up_arguments(tmp_path, monkeypatch):
+    monkeypatch.setenv('PRE_COMMIT_CPP_CACHE', str(tmp_path / 'cache'))
+    for name in ('AUTHOR', 'COMMITTER'):
+        monkeypatch.setenv('GIT_{}_NAME'.format(name), 'Git User')
+        monkeypatch.setenv('GIT_{}_EMAIL'.format(name), 'user@example.com')
+    repo = tmp_path / 'repo'
+    os.makedirs(str(repo / 'src' / 'a'))
+    (repo / 'src' / 'a' / 'b.h').write_text('int b;\n')
+    (repo / 'src' / 'a' / 'x.cc').write_text('#include "b.h"\n')
+    git(repo, 'init', '-q')
+    git(repo, 'add', '.')
+    git(repo, 'commit', '-q', '-m', 'init')
+    sessions = Sessions()
+    argv = ['--enable=normalise-cpp,legal', '--src=src', '--no-cache', '-j1',
+            '--stdin-filename=src/a/x.cc']
+    results = [sessions.handle(argv, str(repo), b'#include "b.h"\n') for _ in range(2)]
+    assert len(sessions.sessions) == 1
+    assert results[0] == results[1]
+    ret, _, content = results[1]
+    assert ret == 1
+    assert b'#include <a/b.h>\n' in content
+    assert b'GNU General Public License' in content
@@ -0,0 +1,20 @@
+from pre_commit_hooks_cpp.header_guard import add_header_guard, find_guard
+
+GUARD = '#ifndef FOO_H\n#define FOO_H\nint x;\n#endif\n'
+RENAMED = '#ifndef FOO_HH\n#define FOO_HH\nint x;\n#endif\n'
+
+def test_guard_after_byte_order_mark():
+    assert find_guard('\ufeff' + GUARD).group(1) == 'FOO_H'
+    assert add_header_guard('foo.hh', '\ufeff' + GUARD) == '\ufeff' + RENAMED
+
+def test_guard_after_pragma_once():
+    assert find_guard('#pragma once\n' + GUARD).group(1) == 'FOO_H'
+    assert add_header_guard('foo.hh', '#pragma once\n' + GUARD) == '#pragma once\n' + RENAMED
+
+def test_guard_after_comments():
+    prologue = '// line comment\n\n/* block\n   comment */\n'
+    assert find_guard(prologue + GUARD).group(1) == 'FOO_H'
+    assert add_header_guard('foo.hh', prologue + GUARD) == prologue + RENAMED
+
+def test_guard_after_code_is_not_found():
+    assert find_guard('int y;\n' + GUARD) is None
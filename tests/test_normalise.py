@@ -0,0 +1,39 @@
+import io
+import random
+
+from pre_commit_hooks_cpp.normalise import WhiteSpaceStream, normalise_line, normalise_text, \
+    remove_empty_lines
+
+ALPHABET = ['a', 'b', ' ', ' ', '\t', '\t', '\n', '\n', '\n', '\x0c']
+
+def random_text(rnd):
+    return ''.join(rnd.choice(ALPHABET) for _ in range(rnd.randrange(0, 40)))
+
+def normalise_per_line(text, nspaces):
+    """Reference implementation: per-line and per-character loops"""
+    lines = io.StringIO(text, newline='\n').readlines()
+    return ''.join(remove_empty_lines([normalise_line(line, nspaces) for line in lines]))
+
+def test_normalise_text_matches_per_line():
+    rnd = random.Random(0)
+    for _ in range(20000):
+        text = random_text(rnd)
+        nspaces = rnd.randrange(1, 9)
+        assert normalise_text(text, nspaces) == normalise_per_line(text, nspaces), repr(text)
+
+def test_white_space_stream_matches_normalise_text():
+    rnd = random.Random(1)
+    for _ in range(20000):
+        text = random_text(rnd)
+        nspaces = rnd.randrange(1, 9)
+        stream = WhiteSpaceStream(nspaces)
+        result = ''
+        position = 0
+        while position < len(text):
+            size = rnd.randrange(1, 8)
+            result += stream.feed(text[position:position+size])
+            position += size
+        result += stream.close()
+        expected = normalise_text(text, nspaces)
+        assert result == expected, repr(text)
+        assert stream.changed == (expected != text), repr(text)